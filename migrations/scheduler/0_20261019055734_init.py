@@ -0,0 +1,80 @@
+from tortoise import BaseDBAsyncClient
+
+RUN_IN_TRANSACTION = True
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        CREATE TABLE IF NOT EXISTS "scheduler_recurrence" (
+    "id" SERIAL NOT NULL PRIMARY KEY,
+    "clinic_id" INT NOT NULL,
+    "start" TIMESTAMPTZ NOT NULL,
+    "frequency" VARCHAR(7) NOT NULL,
+    "interval" SMALLINT NOT NULL  DEFAULT 1,
+    "until" DATE,
+    "count" INT,
+    "status" VARCHAR(50) NOT NULL,
+    "description" TEXT,
+    "is_return" BOOL NOT NULL  DEFAULT False,
+    "is_off" BOOL NOT NULL  DEFAULT False,
+    "off_reason" TEXT,
+    "patient" VARCHAR(255),
+    "desk" VARCHAR(255) NOT NULL,
+    "user" INT,
+    "created_at" TIMESTAMPTZ NOT NULL  DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS "idx_scheduler_r_clinic__4638b7" ON "scheduler_recurrence" ("clinic_id");
+CREATE INDEX IF NOT EXISTS "idx_scheduler_r_start_1081ed" ON "scheduler_recurrence" ("start");
+CREATE INDEX IF NOT EXISTS "idx_scheduler_r_until_6ab83e" ON "scheduler_recurrence" ("until");
+COMMENT ON COLUMN "scheduler_recurrence"."frequency" IS 'DAILY: DAILY\nWEEKLY: WEEKLY\nMONTHLY: MONTHLY';
+COMMENT ON TABLE "scheduler_recurrence" IS 'Recurrence rule of a series of scheduler events';
+CREATE TABLE IF NOT EXISTS "scheduler_recurrence_exception" (
+    "id" SERIAL NOT NULL PRIMARY KEY,
+    "date" DATE NOT NULL,
+    "recurrence_id" INT NOT NULL REFERENCES "scheduler_recurrence" ("id") ON DELETE CASCADE,
+    CONSTRAINT "uid_scheduler_r_recurre_eb9910" UNIQUE ("recurrence_id", "date")
+);
+COMMENT ON TABLE "scheduler_recurrence_exception" IS 'Occurrence of a series that must not be expanded';
+CREATE TABLE IF NOT EXISTS "aerich" (
+    "id" SERIAL NOT NULL PRIMARY KEY,
+    "version" VARCHAR(255) NOT NULL,
+    "app" VARCHAR(100) NOT NULL,
+    "content" JSONB NOT NULL
+);"""
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        DROP TABLE IF EXISTS "scheduler_recurrence_exception";
+        DROP TABLE IF EXISTS "scheduler_recurrence";"""
+
+
+MODELS_STATE = (
+    "eJztmVtz2jgUx7+Khqdkhs0kNGk6fYOEbNhw2Ql0223IMMIWoMGWqCSHMB2++x7JN3wjkC"
+    "YsmeYJc3yOLP18dP6W9LMkrQmxPYeIo1tieUIQZpH6o0VminLW4jZxSp/RzxLDLoGLTdzL"
+    "qIRns4Sztik8dJJNDETUxICEbZjwoVQCWwq8R9iRBEw2kZagvge00bHCSMRHCCNJBCUSqQ"
+    "lWyPWkQowrNCSIPM4ws4mtW7W5Bc1SNn5OA33WZ90pnc2IjXgUKxFnzgJN8AOBUO0djOII"
+    "XRKF9UAT3jAY3mfGHR6poGXscEZQhASRB8JUGVmCYAXBc6ompuW4FfSAHY/Icp/NJ9SaIA"
+    "sz7cFMb20KUWXk8gf9ZIEE8S8dOoVHsgXi4Bo85UhD8Rj94ZGB4mOi7wCau7tS/F4MN+hJ"
+    "6f4eriiQeCRSO+m/s+lgRIljJxKEGtbGPlCLmbE1mLoyjrq14cDijuey2Hm2UBPOIm/KlL"
+    "aOCSNCQwCbEp5OAuY5TpBFYV74/Y9d/C6uxNhkhD1Hp5KOzmRSaFzJjcBkcaazEHojzQDH"
+    "+il/VE5Oz08/ffh4+glcTE8iy/nSH148dj/QEGj3SsulDxP7HgZjzM1QzpC7BGs+utA/BU"
+    "+bFXXJUXh/FWMIbR3H0BCDjKfgy5Bcg+my2qsbTjGXlRqxVWpl4p7Osv3A8xKJpmfnaJqb"
+    "Z8m5nYR5xQWhY3ZDFoZpg+kSZeWlWZ4MRNV//5guw+wIrXF9EHgeVbFs0sCQYVBEmUFfVL"
+    "sX1UtIUI13iK3pHAt7kOCs7/AKT1ki3+wtt+KmLZjhsaGgx6J7Xgz7KWV+viBvJsPxk5CA"
+    "BhJSCtcpWZMZFd4yXotwbxL4UgkKCgkLOqfjQUsRVTIptyIWcPBCNnGNG5PUJn2mddXCDg"
+    "EVFqC0zOZzEFHomu4CqGaRQL5L4etKoeVQRq3tyn0i5rVK/V5yXKkACguV/w2hPwnywUVB"
+    "6z4k9MVeIlzDp9do1bu9autv3XFXyh9O+IWh71SMdZGyHnw8NFUfqp5fGqNG0NdG7xrpv+"
+    "h7p103wLhUY2GeGPv1vpd0n7Cn+IDx+QDbq6xCc2hKvL6RIECNWYvsK7yYYFFnnpuR5cSr"
+    "TDSQFmwldirNgLTR/PczMj999rVev9F//d8+a3XavWttCC7SylAwYVz8OIB6PVYT+Ltucv"
+    "xTvb24rt4enB+m5gg0BbUdO1nGXRc7TnF5Xonb3ZfkyS8Xlw+V849RXdF/1lHrtqrNZrau"
+    "eEzRHGDFa5Mo4BcXJ0Gx2ItykrM0sbjHcuptsUaF/s9KoKdh7ONKJKVPypP51a1QnIKI/7"
+    "mcbc4sUaLOjjeoUWfH6SK1+uwMrR55LMivVNizkO0+y9ZJeP1bL6He7ZBZq/rtMKHgzU77"
+    "z9A9lu/2RbNTSyuAhGWO8kQO2hrnDsGsQAFW41JshxD4WvmYv/R6Cby1TqeZwFtrpPl9ad"
+    "XqtwcnhjU4UX8hnJ3aAIePRtsTDYLecSZxAhZINiy3m//JqPfpnzv9Z1hRkifbxSq0EvJG"
+    "oCZVqHJ2toEMgVeODk23ARX6v02xfjYmT/obaht+Bobuv+lXYHC0NcBbb1UkI3ezX/HiNG"
+    "EMdoc5i+BdvpENjCDtMvsXmYOG4q3xOAOiU9KctUAtiL26uSUOLvqU3egQev9eftExxPKV"
+    "jw2qRFBrUso/LQhulp84JMCx21PHAsU83jfTd76Z/kCEzF1HFsv4SshvpuR6BmwBKnB/m5"
+    "BOjjfZnACvNCRoVeV+Qf/V7bSLdr6ikBSsLwwGcWdTS5WRQ6W63090a0jpUa9fpaQXJCnp"
+    "1Q3U8g7td3nMvPwPHdFZgA=="
+)
@@ -0,0 +1,5 @@
+"""Plus Planner scheduler service"""
+
+import time
+
+STARTED_AT = time.perf_counter()
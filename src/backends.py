@@ -1,6 +1,23 @@
 """Backend functions for plus_db_agent"""
 
-from plus_db_agent.models import ClinicModel, DeskModel
+import asyncio
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Set
+
+from plus_db_agent.models import ClinicModel, DeskModel, SchedulerModel
+from tortoise import connections
+from tortoise.backends.base.client import BaseDBAsyncClient
+from tortoise.signals import post_delete, post_save
+
+from src.config import (
+    CLINIC_IDS_REFRESH_SECONDS,
+    CLINIC_NEGATIVE_CACHE_SIZE,
+    CLINIC_NEGATIVE_TTL,
+)
+from src.database import get_read_connection
+from src.utils import to_utc
 
 
 async def check_clinic_id(pk: int) -> bool:
@@ -8,6 +25,97 @@ async def check_clinic_id(pk: int) -> bool:
     return await ClinicModel.exists(id=pk)
 
 
+class ClinicIdCache:
+    """In-memory clinic existence check
+
+    Known ids come from a set rebuilt every CLINIC_IDS_REFRESH_SECONDS, ids
+    missing from it are checked on the database once and, when absent, cached
+    as negative for CLINIC_NEGATIVE_TTL. Clinic saves and deletes done through
+    the ORM of this process update the cache right away. Clinics are managed
+    by another service, so its changes only show up on the next refresh, or
+    right away when it calls the admin invalidation endpoint.
+    """
+
+    def __init__(self) -> None:
+        self.ids: Set[int] = set()
+        self.refreshed_at: Optional[float] = None
+        self.missing: "OrderedDict[int, float]" = OrderedDict()
+        self._lock: Optional[asyncio.Lock] = None
+
+    async def refresh(self) -> None:
+        """Rebuild the set of clinic ids"""
+        ids = (
+            await ClinicModel.all()
+            .using_db(get_read_connection())
+            .values_list("id", flat=True)
+        )
+        self.ids = set(ids)
+        self.refreshed_at = time.monotonic()
+
+    async def __refresh_if_stale(self) -> None:
+        """Rebuild the set once per interval, concurrent callers wait for it"""
+        if (
+            self.refreshed_at is not None
+            and time.monotonic() - self.refreshed_at < CLINIC_IDS_REFRESH_SECONDS
+        ):
+            return
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if (
+                self.refreshed_at is None
+                or time.monotonic() - self.refreshed_at >= CLINIC_IDS_REFRESH_SECONDS
+            ):
+                await self.refresh()
+
+    def add(self, pk: int) -> None:
+        """Register an existing clinic"""
+        self.ids.add(pk)
+        self.missing.pop(pk, None)
+
+    def remove(self, pk: int) -> None:
+        """Register a missing clinic"""
+        self.ids.discard(pk)
+        self.missing.pop(pk, None)
+        self.missing[pk] = time.monotonic() + CLINIC_NEGATIVE_TTL
+        while len(self.missing) > CLINIC_NEGATIVE_CACHE_SIZE:
+            self.missing.popitem(last=False)
+
+    def forget(self, pk: int) -> None:
+        """Drop what is known about a clinic, the next check reads the database"""
+        self.ids.discard(pk)
+        self.missing.pop(pk, None)
+
+    async def exists(self, pk: int) -> bool:
+        """Check if the clinic exists, usually without a database round trip"""
+        await self.__refresh_if_stale()
+        if pk in self.ids:
+            return True
+        expires_at = self.missing.get(pk)
+        if expires_at is not None and expires_at > time.monotonic():
+            return False
+        if await check_clinic_id(pk):
+            self.add(pk)
+            return True
+        self.remove(pk)
+        return False
+
+
+clinic_ids = ClinicIdCache()
+
+
+@post_save(ClinicModel)
+async def clinic_saved(sender, instance, created, using_db, update_fields) -> None:
+    """Register saved clinics in the existence cache"""
+    clinic_ids.add(instance.pk)
+
+
+@post_delete(ClinicModel)
+async def clinic_deleted(sender, instance, using_db) -> None:
+    """Drop deleted clinics from the existence cache"""
+    clinic_ids.remove(instance.pk)
+
+
 async def check_desk_exist(desk_id: int) -> bool:
     """Check if desk exists"""
     return await DeskModel.exists(id=desk_id)
@@ -16,3 +124,183 @@ async def check_desk_exist(desk_id: int) -> bool:
 async def check_desk_vacancy(desk_id: int) -> bool:
     """Check if desk vacancy"""
     return await DeskModel.exists(id=desk_id, is_vacant=True)
+
+
+# releases of plus_db_agent without the version column compare the previous
+# values the client informs instead
+HAS_EVENT_VERSION = "version" in SchedulerModel._meta.fields_map
+EVENT_COLUMNS = (
+    "id",
+    *(("version",) if HAS_EVENT_VERSION else ()),
+    "date",
+    "description",
+    "is_return",
+    "is_off",
+    "off_reason",
+    "patient",
+    "desk",
+)
+EDITABLE_EVENT_FIELDS = (
+    "status",
+    "date",
+    "description",
+    "is_return",
+    "is_off",
+    "off_reason",
+    "patient",
+    "desk",
+)
+
+
+def _column(field: str) -> str:
+    """Return the quoted scheduler column of a model field"""
+    return '"{}"'.format(SchedulerModel._meta.fields_db_projection.get(field, field))
+
+
+def _row_dict(*rows) -> dict:
+    """Merge returned rows into a dict, parsing dates SQLite returns as text"""
+    row = {}
+    for returned in rows:
+        row.update(dict(returned))
+    for key in ("date", "previous_date"):
+        if isinstance(row.get(key), str):
+            row[key] = datetime.fromisoformat(row[key])
+    return row
+
+
+def _placeholder(connection: BaseDBAsyncClient, index: int) -> str:
+    """Return the query parameter placeholder of the connection dialect"""
+    return f"${index}" if connection.capabilities.dialect == "postgres" else "?"
+
+
+def _expected_conditions(
+    connection: BaseDBAsyncClient,
+    table: str,
+    values: List[Any],
+    version: Optional[int],
+    expected: Optional[Dict[str, Any]],
+) -> List[str]:
+    """Return the conditions matching the row the client last saw
+
+    The version is compared when the model has it, otherwise the previous
+    values informed by the client. The compared values are appended to values.
+    """
+    conditions = []
+    if version is not None and HAS_EVENT_VERSION:
+        values.append(version)
+        conditions.append(
+            f'{table}."version" = {_placeholder(connection, len(values))}'
+        )
+    elif expected:
+        for field, value in expected.items():
+            if value is None:
+                conditions.append(f"{table}.{_column(field)} IS NULL")
+                continue
+            values.append(
+                to_utc(value)
+                if isinstance(value, datetime)
+                else getattr(value, "value", value)
+            )
+            conditions.append(
+                f"{table}.{_column(field)} = {_placeholder(connection, len(values))}"
+            )
+    return conditions
+
+
+async def update_event_if_version(
+    event_id: int,
+    clinic_id: int,
+    changes: Dict[str, Any],
+    version: Optional[int] = None,
+    expected: Optional[Dict[str, Any]] = None,
+) -> Optional[dict]:
+    """Update only the changed fields of an event in a single statement
+
+    The update applies only while the event still has the informed version,
+    or the expected values when the model has no version, and bumps the
+    version. Returns the updated row with its previous date and desk, or None
+    when nothing matched. SQLite, used locally, needs an extra read for the
+    previous values.
+    """
+    connection = connections.get("default")
+    table = f'"{SchedulerModel._meta.db_table}"'
+    assignments, values = [], []
+    for field, value in changes.items():
+        values.append(getattr(value, "value", value))
+        assignments.append(
+            f"{_column(field)} = {_placeholder(connection, len(values))}"
+        )
+    if HAS_EVENT_VERSION:
+        assignments.append(f'"version" = {table}."version" + 1')
+    values.extend([event_id, clinic_id])
+    conditions = [
+        f"{table}.{_column('id')} = {_placeholder(connection, len(values) - 1)}",
+        f"{table}.{_column('clinic_id')} = {_placeholder(connection, len(values))}",
+    ]
+    conditions.extend(
+        _expected_conditions(connection, table, values, version, expected)
+    )
+    returning = ", ".join(
+        f'{table}.{_column(field)} AS "{field}"' for field in EVENT_COLUMNS
+    )
+    if connection.capabilities.dialect == "postgres":
+        # the self join exposes the row as it was before the update
+        query = (
+            f"UPDATE {table} SET {', '.join(assignments)} "
+            f"FROM {table} AS previous "
+            f"WHERE {table}.{_column('id')} = previous.{_column('id')} "
+            f"AND {' AND '.join(conditions)} "
+            f"RETURNING {returning}, previous.{_column('date')} AS previous_date, "
+            f"previous.{_column('desk')} AS previous_desk"
+        )
+        _, rows = await connection.execute_query(query, values)
+        return _row_dict(rows[0]) if rows else None
+
+    # SQLite RETURNING only sees the new row, read the previous one first
+    _, previous_rows = await connection.execute_query(
+        f"SELECT {_column('date')} AS previous_date, "
+        f"{_column('desk')} AS previous_desk FROM {table} "
+        f"WHERE {_column('id')} = {_placeholder(connection, 1)}",
+        [event_id],
+    )
+    query = (
+        f"UPDATE {table} SET {', '.join(assignments)} "
+        f"WHERE {' AND '.join(conditions)} RETURNING {returning}"
+    )
+    _, rows = await connection.execute_query(query, values)
+    if not rows:
+        return None
+    return _row_dict(previous_rows[0], rows[0])
+
+
+async def delete_event_if_version(
+    event_id: int,
+    clinic_id: int,
+    version: Optional[int] = None,
+    expected: Optional[Dict[str, Any]] = None,
+) -> Optional[dict]:
+    """Delete an event in a single statement while it has the informed version
+
+    Without the version column the expected values are compared instead.
+    Returns the id, date and desk of the deleted row, or None when nothing
+    matched.
+    """
+    connection = connections.get("default")
+    table = f'"{SchedulerModel._meta.db_table}"'
+    values: List[Any] = [event_id, clinic_id]
+    conditions = [
+        f"{_column('id')} = {_placeholder(connection, 1)}",
+        f"{_column('clinic_id')} = {_placeholder(connection, 2)}",
+    ]
+    conditions.extend(
+        _expected_conditions(connection, table, values, version, expected)
+    )
+    returning = ", ".join(
+        f'{_column(field)} AS "{field}"' for field in ("id", "date", "desk")
+    )
+    query = (
+        f"DELETE FROM {table} WHERE {' AND '.join(conditions)} "
+        f"RETURNING {returning}"
+    )
+    _, rows = await connection.execute_query(query, values)
+    return _row_dict(rows[0]) if rows else None
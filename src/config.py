@@ -9,13 +9,29 @@ load_dotenv()
 # PostgresSQL config
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 DB_HOST = os.getenv("POSTGRESQL_HOST", "localhost")
+DB_REPLICA_HOSTS = [
+    host.strip()
+    for host in os.getenv("POSTGRESQL_REPLICA_HOSTS", "").split(",")
+    if host.strip()
+]
+DB_WRITE_POOL = (
+    int(os.getenv("DB_WRITE_POOL_MIN", "1")),
+    int(os.getenv("DB_WRITE_POOL_MAX", "10")),
+)
+DB_READ_POOL = (
+    int(os.getenv("DB_READ_POOL_MIN", "1")),
+    int(os.getenv("DB_READ_POOL_MAX", "10")),
+)
+# Reads of a client that wrote within this window go to the primary
+READ_YOUR_WRITES_SECONDS = float(os.getenv("READ_YOUR_WRITES_SECONDS", "5"))
 
 
-def get_database_url(test=False, sqlite=False):
+def get_database_url(test=False, sqlite=False, server=None, pool=None):
     """Return database url"""
     if sqlite:
         return "sqlite://db.sqlite3"
-    server = DB_HOST if not test else os.getenv("POSTGRESQL_HOST_TEST", "localhost")
+    if server is None:
+        server = DB_HOST if not test else os.getenv("POSTGRESQL_HOST_TEST", "localhost")
     db = os.getenv("POSTGRESQL_DATABASE", "app") if not test else "db_test"
     user = (
         os.getenv("POSTGRESQL_USER", "root")
@@ -28,10 +44,84 @@ def get_database_url(test=False, sqlite=False):
         else os.getenv("POSTGRESQL_PASSWORD_TEST", "")
     )
     port = os.getenv("POSTGRESQL_PORT", "5432")
-    return f"postgres://{user}:{password}@{server}:{port}/{db}"
+    url = f"postgres://{user}:{password}@{server}:{port}/{db}"
+    if pool:
+        url += f"?minsize={pool[0]}&maxsize={pool[1]}"
+    return url
+
+
+def get_database_connections():
+    """Return the primary (default) and read replica connections
+
+    DATABASE_URL and DATABASE_REPLICA_URLS (comma separated) take precedence
+    over the PostgreSQL settings, e.g. two sqlite:// files work locally.
+    """
+    primary = os.getenv("DATABASE_URL") or get_database_url(pool=DB_WRITE_POOL)
+    replicas = [
+        url.strip()
+        for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",")
+        if url.strip()
+    ] or [get_database_url(server=host, pool=DB_READ_POOL) for host in DB_REPLICA_HOSTS]
+    db_connections = {"default": primary}
+    for index, url in enumerate(replicas):
+        db_connections[f"replica_{index}"] = url
+    return db_connections
+
+
+DB_CONNECTIONS = get_database_connections()
+READ_CONNECTIONS = [name for name in DB_CONNECTIONS if name != "default"]
+
 
+TORTOISE_ORM = {
+    "connections": DB_CONNECTIONS,
+    "apps": {
+        "models": {
+            "models": ["plus_db_agent.models"],
+            "default_connection": "default",
+        },
+        "scheduler": {
+            "models": ["src.models", "aerich.models"],
+            "default_connection": "default",
+        },
+    },
+}
 
 DEBUG = os.getenv("DEBUG")
+CLINIC_TIMEZONE = os.getenv("CLINIC_TIMEZONE", "America/Sao_Paulo")
+
+# Startup and cache config.
+WARMUP = os.getenv("WARMUP", "false").lower() in ("1", "true", "yes")
+WARMUP_CLINICS = int(os.getenv("WARMUP_CLINICS", "50"))
+# Cached windows and event store months only see the writes of this process
+# until they expire, writes of other instances or services show up after the
+# TTL. The window cache is off by default, keep it to a few seconds when the
+# database is shared.
+CALENDAR_CACHE_TTL = float(os.getenv("CALENDAR_CACHE_TTL", "0"))
+CALENDAR_CACHE_MAX_WINDOWS = int(os.getenv("CALENDAR_CACHE_MAX_WINDOWS", "32"))
+EVENT_STORE = os.getenv("EVENT_STORE", "false").lower() in ("1", "true", "yes")
+EVENT_STORE_TTL = float(os.getenv("EVENT_STORE_TTL", "300"))
+CLINIC_IDS_REFRESH_SECONDS = float(os.getenv("CLINIC_IDS_REFRESH_SECONDS", "30"))
+CLINIC_NEGATIVE_TTL = float(os.getenv("CLINIC_NEGATIVE_TTL", "30"))
+CLINIC_NEGATIVE_CACHE_SIZE = int(os.getenv("CLINIC_NEGATIVE_CACHE_SIZE", "10000"))
+
+
+def get_clinic_weights():
+    """Return the queue weight of each clinic from CLINIC_WEIGHTS
+
+    The variable lists clinic_id:weight pairs separated by commas, e.g.
+    "12:2,40:0.5". Clinics not listed have weight 1.
+    """
+    weights = {}
+    for item in os.getenv("CLINIC_WEIGHTS", "").split(","):
+        if not item.strip():
+            continue
+        clinic_id, weight = item.split(":")
+        if float(weight) > 0:
+            weights[int(clinic_id)] = float(weight)
+    return weights
+
+
+CLINIC_WEIGHTS = get_clinic_weights()
 
 # Logging config.
 
@@ -43,6 +133,12 @@ DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
 date_str = datetime.now().strftime("%Y-%m-%d")
 LOG_FILENAME = f"{BASE_DIR}/logs/{date_str}.log"
 
+# Profiling config.
+
+ADMIN_KEY = os.getenv("ADMIN_KEY")
+TRACE_FILE = os.getenv("TRACE_FILE", f"{BASE_DIR}/logs/traces.jsonl")
+PROFILE_MAX_SECONDS = 60
+
 DEFAULT_DATE_FORMAT = "%d/%m/%Y"
 DEFAULT_DATE_TIME_FORMAT = "%d/%m/%Y %H:%M:%S"
 
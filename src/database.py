@@ -0,0 +1,55 @@
+"""Routing of queries between the primary and the read replicas"""
+
+import itertools
+import time
+from typing import Optional
+
+from plus_db_agent.manager import close, init
+from tortoise import Tortoise, connections
+from tortoise.backends.base.client import BaseDBAsyncClient
+from tortoise.timezone import get_timezone, get_use_tz
+
+from src.config import READ_CONNECTIONS, READ_YOUR_WRITES_SECONDS, TORTOISE_ORM
+
+_replicas = itertools.cycle(READ_CONNECTIONS) if READ_CONNECTIONS else None
+
+
+def wrote_recently(last_write_at: Optional[float]) -> bool:
+    """Check if a write happened within the read-your-writes window"""
+    return (
+        last_write_at is not None
+        and time.monotonic() - last_write_at < READ_YOUR_WRITES_SECONDS
+    )
+
+
+def get_write_connection() -> BaseDBAsyncClient:
+    """Return the primary connection"""
+    return connections.get("default")
+
+
+def get_read_connection(last_write_at: Optional[float] = None) -> BaseDBAsyncClient:
+    """Return the next read replica, or the primary when there is no replica
+    or the caller wrote recently"""
+    if _replicas is None or wrote_recently(last_write_at):
+        return get_write_connection()
+    return connections.get(next(_replicas))
+
+
+async def init_database() -> None:
+    """Initialize the database the way plus_db_agent does, plus the service
+    models and read replicas
+
+    plus_db_agent.manager.init() still runs first so its setup of the shared
+    database is kept. Tortoise is then initialized again with TORTOISE_ORM,
+    keeping the timezone settings plus_db_agent chose, to register the
+    "scheduler" app and the replica connections.
+    """
+    await init()
+    await Tortoise.init(
+        config={**TORTOISE_ORM, "use_tz": get_use_tz(), "timezone": get_timezone()}
+    )
+
+
+async def close_database() -> None:
+    """Close every connection through plus_db_agent"""
+    await close()
@@ -49,3 +49,40 @@ class MessageType(int, Enum):
     INVALID = 9
     ERROR = 10
     DISCONNECT = 11
+    SUBSCRIBE = 12
+    ADD_RECURRENCE = 13
+    REMOVE_RECURRENCE = 14
+    SKIP_OCCURRENCE = 15
+    CALENDAR_INVALIDATED = 16
+    CONFLICT = 17
+    DETACH_OCCURRENCE = 18
+
+
+class RecurrenceFrequency(str, Enum):
+    """Recurrence Frequency Enum"""
+
+    DAILY = "DAILY"
+    WEEKLY = "WEEKLY"
+    MONTHLY = "MONTHLY"
+
+
+class ExportFormat(str, Enum):
+    """Export Format Enum"""
+
+    ICS = "ics"
+    CSV = "csv"
+
+
+class ImportFormat(str, Enum):
+    """Import Format Enum"""
+
+    NDJSON = "ndjson"
+    CSV = "csv"
+
+
+class MessagePriority(int, Enum):
+    """Message Priority Enum, lower values are processed first"""
+
+    HANDSHAKE = 0
+    WRITE = 1
+    READ = 2
@@ -1,19 +1,59 @@
 """Main Service"""
 
+import asyncio
+import hmac
 import logging
 import os
+import threading
+import time
 from contextlib import asynccontextmanager
+from datetime import date
 from logging.handlers import TimedRotatingFileHandler
 
-from fastapi import FastAPI, WebSocket
+from fastapi import (
+    Depends,
+    FastAPI,
+    Header,
+    HTTPException,
+    Query,
+    Request,
+    WebSocket,
+    status,
+)
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import RedirectResponse
-from plus_db_agent.manager import close, init
+from fastapi.responses import (
+    JSONResponse,
+    PlainTextResponse,
+    RedirectResponse,
+    StreamingResponse,
+)
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 from tortoise import connections
 from tortoise.exceptions import DBConnectionError
 
-from src.config import BASE_DIR, DATE_FORMAT, FORMAT, LOG_FILENAME, ORIGINS
+from src import STARTED_AT
+from src.backends import clinic_ids
+from src.config import (
+    ADMIN_KEY,
+    BASE_DIR,
+    DATE_FORMAT,
+    FORMAT,
+    LOG_FILENAME,
+    ORIGINS,
+    PROFILE_MAX_SECONDS,
+    TRACE_FILE,
+    WARMUP,
+)
+from src.database import close_database, init_database
+from src.enums import ExportFormat, ImportFormat
+from src.profiling import StackSampler, tracer
+from src.scheduler.analytics import get_clinic_analytics
+from src.scheduler.api_client import get_api_client
+from src.scheduler.export import CONTENT_TYPES, export_schedule
+from src.scheduler.importer import import_events, iter_spooled, spool_stream
 from src.scheduler.manager import ConnectionManager
+from src.scheduler.warmup import warmup
 
 if not os.path.exists(f"{BASE_DIR}/logs/"):
     os.makedirs(f"{BASE_DIR}/logs/")
@@ -30,15 +70,33 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
+async def run_warmup(app: FastAPI) -> None:
+    """Warm the caches up and flag the service as ready"""
+    started_at = time.perf_counter()
+    await warmup()
+    app.state.warmup_seconds = time.perf_counter() - started_at
+    app.state.ready = True
+    logger.info("Warmup finished in %.3fs", app.state.warmup_seconds)
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Context manager for the lifespan of the application."""
     logger.info("Service Version %s", app.version)
+    logger.info("Service imported in %.3fs", app.state.import_seconds)
     # db connected
-    await init()
-    ConnectionManager().start_main_thread()
+    await init_database()
+    manager = ConnectionManager()
+    manager.start()
+    app.state.ready = not WARMUP
+    app.state.profiling = False
+    app.state.warmup_seconds = None
+    warmup_task = asyncio.create_task(run_warmup(app)) if WARMUP else None
     yield
-    await close()
+    if warmup_task is not None:
+        warmup_task.cancel()
+    await manager.stop()
+    await close_database()
 
 
 appAPI = FastAPI(
@@ -46,6 +104,8 @@ appAPI = FastAPI(
     lifespan=lifespan,
 )
 
+appAPI.state.import_seconds = time.perf_counter() - STARTED_AT
+
 appAPI.add_middleware(
     CORSMiddleware,
     allow_origins=ORIGINS,
@@ -55,6 +115,28 @@ appAPI.add_middleware(
 )
 
 
+security = HTTPBearer()
+
+
+def check_token(
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+) -> str:
+    """Check the bearer token against the auth service"""
+    if not get_api_client().check_is_token_is_valid(credentials.credentials):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED, detail="Token inválido"
+        )
+    return credentials.credentials
+
+
+def check_admin_key(x_admin_key: str = Header(default="")) -> None:
+    """Check the X-Admin-Key header against the configured admin key"""
+    if not ADMIN_KEY or not hmac.compare_digest(x_admin_key, ADMIN_KEY):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN, detail="Acesso negado"
+        )
+
+
 @appAPI.get("/", tags=["Service"])
 def root():
     """Redirect to docs"""
@@ -71,8 +153,146 @@ async def health():
         return {"status": "Database connection error"}
 
 
+@appAPI.get("/ready", tags=["Service"])
+async def ready():
+    """Readiness check, ready once the warmup is complete"""
+    content = {
+        "status": "ready" if appAPI.state.ready else "warming up",
+        "importSeconds": round(appAPI.state.import_seconds, 3),
+        "warmupSeconds": (
+            round(appAPI.state.warmup_seconds, 3)
+            if appAPI.state.warmup_seconds is not None
+            else None
+        ),
+    }
+    return JSONResponse(
+        content=content,
+        status_code=(
+            status.HTTP_200_OK
+            if appAPI.state.ready
+            else status.HTTP_503_SERVICE_UNAVAILABLE
+        ),
+    )
+
+
+@appAPI.get("/queue/stats", tags=["Service"])
+async def queue_stats():
+    """Wait time statistics of the message queue per priority class"""
+    manager = ConnectionManager()
+    if manager.queue is None:
+        return {}
+    return manager.queue.get_stats()
+
+
+@appAPI.post(
+    "/admin/clinics/{clinic_id}/invalidate",
+    tags=["Service"],
+    status_code=status.HTTP_204_NO_CONTENT,
+)
+async def invalidate_clinic(clinic_id: int, _: None = Depends(check_admin_key)):
+    """Forget the cached existence of a clinic created or deleted elsewhere"""
+    clinic_ids.forget(clinic_id)
+
+
+@appAPI.post("/admin/profile", tags=["Service"])
+async def profile(
+    seconds: float = Query(5, gt=0, le=PROFILE_MAX_SECONDS),
+    trace: bool = True,
+    include_all: bool = False,
+    _: None = Depends(check_admin_key),
+):
+    """Sample the event loop for some seconds returning collapsed stacks
+
+    While sampling, the spans of each processed message are appended to the
+    trace file.
+    """
+    if appAPI.state.profiling:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT, detail="Profiling em andamento"
+        )
+    appAPI.state.profiling = True
+    sampler = StackSampler(threading.get_ident(), include_all=include_all)
+    try:
+        if trace:
+            tracer.start(TRACE_FILE)
+        await asyncio.to_thread(sampler.sample, seconds)
+    finally:
+        tracer.stop()
+        appAPI.state.profiling = False
+    logger.info("Profiled %.1fs, %d stacks", seconds, len(sampler.samples))
+    return PlainTextResponse(sampler.collapsed())
+
+
 @appAPI.websocket("/scheduler/{clinic_id}/")
 async def scheduler(websocket: WebSocket, clinic_id: int):
     """Websocket connection"""
     manager = ConnectionManager()
     await manager.connect(websocket, clinic_id)
+
+
+@appAPI.get("/scheduler/{clinic_id}/export/", tags=["Scheduler"])
+async def export(
+    clinic_id: int,
+    start: date,
+    end: date,
+    export_format: ExportFormat = Query(ExportFormat.ICS, alias="format"),
+    _: str = Depends(check_token),
+):
+    """Stream the clinic schedule as iCalendar or CSV"""
+    if end < start:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="A data final deve ser posterior à data inicial.",
+        )
+    if not await clinic_ids.exists(clinic_id):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Clínica não encontrada."
+        )
+    filename = f"agenda-{clinic_id}-{start}-{end}.{export_format.value}"
+    return StreamingResponse(
+        export_schedule(clinic_id, start, end, export_format),
+        media_type=CONTENT_TYPES[export_format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
+@appAPI.post("/scheduler/{clinic_id}/import/", tags=["Scheduler"])
+async def import_schedule(
+    clinic_id: int,
+    request: Request,
+    import_format: ImportFormat = Query(ImportFormat.NDJSON, alias="format"),
+    token: str = Depends(check_token),
+):
+    """Import NDJSON or CSV events streaming the progress as NDJSON"""
+    if not await clinic_ids.exists(clinic_id):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Clínica não encontrada."
+        )
+    user_dict = await run_in_threadpool(get_api_client().get_user_by_token, token)
+    body = await spool_stream(request.stream())
+    return StreamingResponse(
+        import_events(
+            clinic_id, iter_spooled(body), import_format, user_dict.get("id")
+        ),
+        media_type="application/x-ndjson",
+    )
+
+
+@appAPI.get("/scheduler/{clinic_id}/analytics/", tags=["Scheduler"])
+async def analytics(
+    clinic_id: int,
+    start: date,
+    end: date,
+    _: str = Depends(check_token),
+):
+    """Desk utilization heatmaps and status rates of the clinic"""
+    if end < start:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="A data final deve ser posterior à data inicial.",
+        )
+    if not await clinic_ids.exists(clinic_id):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Clínica não encontrada."
+        )
+    return await get_clinic_analytics(clinic_id, start, end)
@@ -0,0 +1,59 @@
+"""Service models stored alongside the plus_db_agent models
+
+They belong to the "scheduler" app, whose tables are managed by the aerich
+migrations of this repository.
+"""
+
+from tortoise import fields
+from tortoise.models import Model
+
+from src.enums import RecurrenceFrequency
+
+
+class RecurrenceModel(Model):
+    """Recurrence rule of a series of scheduler events
+
+    The rule is stored once and its occurrences are expanded on demand inside
+    the calendar window being served.
+    """
+
+    id = fields.IntField(pk=True)
+    clinic_id = fields.IntField(index=True)
+    start = fields.DatetimeField(index=True)
+    frequency = fields.CharEnumField(RecurrenceFrequency)
+    interval = fields.SmallIntField(default=1)
+    until = fields.DateField(null=True, index=True)
+    count = fields.IntField(null=True)
+    status = fields.CharField(max_length=50)
+    description = fields.TextField(null=True)
+    is_return = fields.BooleanField(default=False)
+    is_off = fields.BooleanField(default=False)
+    off_reason = fields.TextField(null=True)
+    patient = fields.CharField(max_length=255, null=True)
+    desk = fields.CharField(max_length=255)
+    user = fields.IntField(null=True)
+    created_at = fields.DatetimeField(auto_now_add=True)
+
+    exceptions: fields.ReverseRelation["RecurrenceExceptionModel"]
+
+    class Meta:
+        table = "scheduler_recurrence"
+
+
+class RecurrenceExceptionModel(Model):
+    """Occurrence of a series that must not be expanded
+
+    Skipped occurrences only have the exception. Detached occurrences also
+    have a standalone scheduler event, created with the occurrence values,
+    which can then be edited, moved or removed like any other event.
+    """
+
+    id = fields.IntField(pk=True)
+    recurrence: fields.ForeignKeyRelation[RecurrenceModel] = fields.ForeignKeyField(
+        "scheduler.RecurrenceModel", related_name="exceptions", on_delete=fields.CASCADE
+    )
+    date = fields.DateField()
+
+    class Meta:
+        table = "scheduler_recurrence_exception"
+        unique_together = (("recurrence", "date"),)
@@ -0,0 +1,158 @@
+"""On-demand sampling profiler and per-message tracing"""
+
+import json
+import os
+import sys
+import time
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Optional
+
+from src.config import BASE_DIR
+
+SOURCE_DIR = os.path.join(BASE_DIR, "src")
+_NULL_SPAN = nullcontext()
+
+
+class StackSampler:
+    """Sample the stack of a thread at a fixed interval
+
+    Stacks are collapsed root first ("file:function;file:function") so they
+    can be fed to flamegraph tools. Only stacks going through the service
+    source are kept unless include_all is set.
+    """
+
+    def __init__(
+        self, thread_id: int, interval: float = 0.005, include_all: bool = False
+    ) -> None:
+        self.thread_id = thread_id
+        self.interval = interval
+        self.include_all = include_all
+        self.samples: Counter = Counter()
+
+    def __collapse(self, frame) -> Optional[str]:
+        """Collapse a frame chain into a single line"""
+        names: List[str] = []
+        in_source = False
+        while frame is not None:
+            code = frame.f_code
+            in_source = in_source or code.co_filename.startswith(SOURCE_DIR)
+            names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+            frame = frame.f_back
+        if not in_source and not self.include_all:
+            return None
+        return ";".join(reversed(names))
+
+    def sample(self, duration: float) -> Counter:
+        """Sample for the given seconds, blocking the calling thread"""
+        deadline = time.monotonic() + duration
+        while time.monotonic() < deadline:
+            frame = sys._current_frames().get(  # pylint: disable=protected-access
+                self.thread_id
+            )
+            if frame is not None:
+                stack = self.__collapse(frame)
+                if stack is not None:
+                    self.samples[stack] += 1
+            del frame
+            time.sleep(self.interval)
+        return self.samples
+
+    def collapsed(self) -> str:
+        """Return the samples in collapsed stack format"""
+        return "".join(
+            f"{stack} {count}\n" for stack, count in self.samples.most_common()
+        )
+
+
+class Trace:
+    """Spans of a single message, from receive to fan-out
+
+    The trace starts as soon as the frame is received. The receive span
+    covers decoding its JSON, received_at keeps the wall clock time so traces
+    can be matched with client logs.
+    """
+
+    __slots__ = (
+        "message_type",
+        "clinic_id",
+        "received_at",
+        "started_at",
+        "spans",
+        "enqueued_at",
+    )
+
+    def __init__(self) -> None:
+        self.message_type: Optional[int] = None
+        self.clinic_id: Optional[int] = None
+        self.received_at = time.time()
+        self.started_at = time.monotonic()
+        self.enqueued_at: Optional[float] = None
+        self.spans: Dict[str, float] = {}
+
+    def add(self, name: str, seconds: float) -> None:
+        """Accumulate seconds into the named span"""
+        self.spans[name] = self.spans.get(name, 0.0) + seconds
+
+    @contextmanager
+    def span(self, name: str) -> Iterator[None]:
+        """Measure the enclosed block into the named span"""
+        started_at = time.monotonic()
+        try:
+            yield
+        finally:
+            self.add(name, time.monotonic() - started_at)
+
+    def to_dict(self) -> dict:
+        """Return the trace as a JSON serializable dict"""
+        return {
+            "messageType": self.message_type,
+            "clinicId": self.clinic_id,
+            "receivedAt": self.received_at,
+            "total": time.monotonic() - self.started_at,
+            "spans": self.spans,
+        }
+
+
+class Tracer:
+    """Exports message traces to a JSON lines file while enabled"""
+
+    def __init__(self) -> None:
+        self.enabled = False
+        self.path: Optional[str] = None
+        self._file = None
+
+    def start(self, path: str) -> None:
+        """Start tracing into the file"""
+        self.path = path
+        self._file = open(path, "a", encoding="utf-8")  # pylint: disable=R1732
+        self.enabled = True
+
+    def stop(self) -> None:
+        """Stop tracing and close the file"""
+        self.enabled = False
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def new_trace(self) -> Optional[Trace]:
+        """Return a new trace, None while disabled"""
+        return Trace() if self.enabled else None
+
+    def export(self, trace: Trace) -> None:
+        """Append the trace to the file"""
+        if self._file is not None:
+            self._file.write(json.dumps(trace.to_dict()) + "\n")
+
+
+tracer = Tracer()
+current_trace: ContextVar[Optional[Trace]] = ContextVar("current_trace", default=None)
+
+
+def span(name: str):
+    """Measure a block into the current trace, a no-op when not tracing"""
+    trace = current_trace.get()
+    if trace is None:
+        return _NULL_SPAN
+    return trace.span(name)
@@ -0,0 +1,190 @@
+"""Desk occupancy and utilization analytics"""
+
+from collections import OrderedDict
+from datetime import date, datetime, time, timedelta
+from typing import Dict, List, Tuple
+from zoneinfo import ZoneInfo
+
+import numpy as np
+from plus_db_agent.models import SchedulerModel
+
+from src.config import CLINIC_TIMEZONE
+from src.database import get_read_connection
+from src.scheduler.export import iter_pages
+from src.scheduler.recurrence import get_window_occurrences
+from src.utils import get_month_windows, to_utc
+
+ANALYTICS_COLUMNS = ("id", "date", "desk", "status", "is_off")
+ANALYTICS_CACHE_SIZE = 256
+HOURS_IN_WEEK = 7 * 24
+# 1970-01-01 was a thursday, the fifth day of a sunday first week
+EPOCH_WEEKDAY = 4
+
+CLINIC_ZONE = ZoneInfo(CLINIC_TIMEZONE)
+
+_cache: "OrderedDict[Tuple[int, date, date], dict]" = OrderedDict()
+
+
+def _local_naive(value: datetime) -> datetime:
+    """Return the clinic local wall time of a stored datetime"""
+    return to_utc(value).astimezone(CLINIC_ZONE).replace(tzinfo=None)
+
+
+def _local_day_start(day: date) -> datetime:
+    """Return the first instant of the clinic local day, in UTC"""
+    return to_utc(datetime.combine(day, time.min, CLINIC_ZONE))
+
+
+async def _load_columns(
+    clinic_id: int, start: date, end: date
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Load the analytics columns of the range into arrays
+
+    The range is made of clinic local days, occurrences are expanded a day
+    around it and kept by their local date.
+    """
+    dates: List = []
+    desks: List = []
+    statuses: List = []
+    offs: List = []
+    using_db = get_read_connection()
+    async for rows in iter_pages(
+        SchedulerModel,
+        ANALYTICS_COLUMNS,
+        "date",
+        using_db=using_db,
+        clinic_id=clinic_id,
+        date__gte=_local_day_start(start),
+        date__lt=_local_day_start(end + timedelta(days=1)),
+    ):
+        _, page_dates, page_desks, page_statuses, page_offs = zip(*rows)
+        dates.extend(_local_naive(value) for value in page_dates)
+        desks.extend(page_desks)
+        statuses.extend(getattr(status, "value", status) for status in page_statuses)
+        offs.extend(page_offs)
+    for window_start, window_end in get_month_windows(
+        start - timedelta(days=1), end + timedelta(days=1)
+    ):
+        for occurrence in await get_window_occurrences(
+            clinic_id, window_start, window_end, using_db
+        ):
+            local_date = _local_naive(occurrence.date)
+            if not start <= local_date.date() <= end:
+                continue
+            dates.append(local_date)
+            desks.append(occurrence.desk)
+            statuses.append(getattr(occurrence.status, "value", occurrence.status))
+            offs.append(occurrence.is_off)
+    return (
+        np.array(dates, dtype="datetime64[m]"),
+        np.array(desks, dtype=object),
+        np.array(statuses, dtype=object),
+        np.array(offs, dtype=bool),
+    )
+
+
+def _hour_of_week(hours: np.ndarray) -> np.ndarray:
+    """Return the sunday first hour of the week of each hour since the epoch"""
+    return ((hours // 24 + EPOCH_WEEKDAY) % 7) * 24 + hours % 24
+
+
+def _slot_cells(desk_index: np.ndarray, hours: np.ndarray) -> np.ndarray:
+    """Return the heatmap cell of each distinct desk hour
+
+    Appointments sharing a desk and an hour occupy that hour once.
+    """
+    if not hours.size:
+        return hours
+    first = hours.min()
+    span = hours.max() - first + 1
+    slots = np.unique(desk_index * span + hours - first)
+    return (slots // span) * HOURS_IN_WEEK + _hour_of_week(slots % span + first)
+
+
+def _available_hours(start: date, end: date) -> np.ndarray:
+    """Return how many times each hour of the week happens in the range"""
+    days = np.arange(np.datetime64(start, "D"), np.datetime64(end, "D") + 1).astype(
+        "int64"
+    )
+    weekday_count = np.bincount((days + EPOCH_WEEKDAY) % 7, minlength=7)
+    return np.repeat(weekday_count, 24)
+
+
+def compute_analytics(
+    dates: np.ndarray,
+    desks: np.ndarray,
+    statuses: np.ndarray,
+    offs: np.ndarray,
+    start: date,
+    end: date,
+) -> dict:
+    """Aggregate the event columns into utilization heatmaps and rates
+
+    Heatmaps hold, per desk, the share of each hour of the week (sunday first,
+    7 rows of 24 hours) that had an appointment, counting each desk hour once.
+    Off blocks are reported on their own heatmap.
+    """
+    total = int(dates.size)
+    result = {
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "total": total,
+        "offRate": 0.0,
+        "statusRates": {},
+        "desks": {},
+    }
+    if not total:
+        return result
+
+    desk_names, desk_index = np.unique(desks.astype(str), return_inverse=True)
+    status_names, status_counts = np.unique(statuses.astype(str), return_counts=True)
+    available = _available_hours(start, end).astype(float)
+    available[available == 0] = np.nan
+    hours = dates.astype("int64") // 60
+    size = desk_names.size * HOURS_IN_WEEK
+    occupied = np.bincount(
+        _slot_cells(desk_index[~offs], hours[~offs]), minlength=size
+    ).reshape(-1, HOURS_IN_WEEK)
+    off = np.bincount(
+        _slot_cells(desk_index[offs], hours[offs]), minlength=size
+    ).reshape(-1, HOURS_IN_WEEK)
+    utilization = np.nan_to_num(occupied / available)
+    off_utilization = np.nan_to_num(off / available)
+    desk_totals = np.bincount(desk_index, minlength=desk_names.size)
+    desk_offs = np.bincount(desk_index[offs], minlength=desk_names.size)
+
+    result["offRate"] = float(offs.mean())
+    result["statusRates"] = {
+        str(name): float(count) / total
+        for name, count in zip(status_names, status_counts)
+    }
+    result["desks"] = {
+        str(name): {
+            "total": int(desk_totals[index]),
+            "offRate": float(desk_offs[index]) / float(desk_totals[index]),
+            "utilization": utilization[index].reshape(7, 24).round(4).tolist(),
+            "offUtilization": off_utilization[index].reshape(7, 24).round(4).tolist(),
+        }
+        for index, name in enumerate(desk_names)
+    }
+    return result
+
+
+def invalidate_analytics(clinic_id: int) -> None:
+    """Drop the cached analytics of the clinic"""
+    for key in [key for key in _cache if key[0] == clinic_id]:
+        del _cache[key]
+
+
+async def get_clinic_analytics(clinic_id: int, start: date, end: date) -> Dict:
+    """Return the clinic analytics, cached when the range is already closed"""
+    key = (clinic_id, start, end)
+    if key in _cache:
+        _cache.move_to_end(key)
+        return _cache[key]
+    result = compute_analytics(*await _load_columns(clinic_id, start, end), start, end)
+    if end < date.today():
+        _cache[key] = result
+        if len(_cache) > ANALYTICS_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return result
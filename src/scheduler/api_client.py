@@ -1,7 +1,8 @@
 """API Client"""
 
 from datetime import datetime
-from typing import Optional
+from functools import lru_cache
+from typing import List, Optional
 
 import requests
 from plus_db_agent.models import HolidayModel
@@ -17,20 +18,20 @@ class APIClient:
         if not INVERTEXTO_TOKEN:
             raise ValueError("INVERTEXTO_TOKEN not set")
 
-        print(AUTH_API_URL)
         if not AUTH_API_URL:
             raise ValueError("AUTH_API_URL not set")
 
         if not AUTH_KEY:
             raise ValueError("AUTH_KEY not set")
 
-    async def __save_holidays(self, holidays: dict) -> None:
+    async def save_holidays(self, holidays: List[dict]) -> None:
         """Save holidays in the database"""
-        await HolidayModel.create(
-            **holidays, date=datetime.strptime(holidays["date"], "%Y-%m-%d")
-        )
+        for holiday in holidays:
+            await HolidayModel.create(
+                **{**holiday, "date": datetime.strptime(holiday["date"], "%Y-%m-%d")}
+            )
 
-    def get_current_year_holidays(self, state: Optional[Ufs] = None) -> bool:
+    def get_current_year_holidays(self, state: Optional[Ufs] = None) -> List[dict]:
         """Get current year holidays"""
         try:
             current_year = datetime.now().year
@@ -39,12 +40,11 @@ class APIClient:
                 url += f"?state={state.value}"
             headers = {"Authorization": f"Bearer {INVERTEXTO_TOKEN}"}
             response = requests.get(url, headers=headers, timeout=500)
-            success = response.status_code == 200
-            if success:
-                self.__save_holidays(response.json())
-            return success
+            if response.status_code == 200:
+                return response.json()
+            return []
         except Exception:  # pylint: disable=broad-except
-            return False
+            return []
 
     def check_is_token_is_valid(self, token: str) -> bool:
         """Check if token is valid"""
@@ -59,3 +59,9 @@ class APIClient:
         headers = {"X-API-Key": AUTH_KEY, "Authorization": f"Bearer {token}"}
         response = requests.get(url, headers=headers, timeout=500)
         return response.json()
+
+
+@lru_cache(maxsize=None)
+def get_api_client() -> APIClient:
+    """Return the API client, built on first use"""
+    return APIClient()
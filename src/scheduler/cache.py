@@ -0,0 +1,67 @@
+"""Cache of calendar windows per clinic"""
+
+import time
+from datetime import date
+from typing import Dict, List, Optional, Tuple
+
+Window = Tuple[date, date]
+
+
+class WindowCache:
+    """TTL cache of the events served for each calendar window of a clinic
+
+    Every write of a clinic bumps its generation and drops its windows, a
+    window loaded before the bump is not stored. Windows are not stored either
+    during the settle seconds after a write, while replicas may lag behind.
+    """
+
+    def __init__(self, ttl: float, max_windows: int, settle: float = 0) -> None:
+        self.ttl = ttl
+        self.max_windows = max_windows
+        self.settle = settle
+        self._windows: Dict[int, Dict[Window, Tuple[float, List]]] = {}
+        self._generations: Dict[int, int] = {}
+        self._written_at: Dict[int, float] = {}
+
+    def generation(self, clinic_id: int) -> int:
+        """Return the current generation of the clinic"""
+        return self._generations.get(clinic_id, 0)
+
+    def get(self, clinic_id: int, window: Window) -> Optional[List]:
+        """Return the cached events of the window, None when missing or expired"""
+        entry = self._windows.get(clinic_id, {}).get(window)
+        if entry is None:
+            return None
+        expires_at, events = entry
+        if expires_at < time.monotonic():
+            del self._windows[clinic_id][window]
+            return None
+        return events
+
+    def set(
+        self, clinic_id: int, window: Window, events: List, generation: int
+    ) -> None:
+        """Store the events of the window if the clinic did not change meanwhile"""
+        if self.ttl <= 0 or generation != self.generation(clinic_id):
+            return
+        written_at = self._written_at.get(clinic_id)
+        if written_at is not None:
+            if time.monotonic() - written_at < self.settle:
+                return
+            del self._written_at[clinic_id]
+        windows = self._windows.setdefault(clinic_id, {})
+        windows.pop(window, None)
+        windows[window] = (time.monotonic() + self.ttl, events)
+        while len(windows) > self.max_windows:
+            del windows[next(iter(windows))]
+
+    def invalidate(self, clinic_id: int) -> None:
+        """Drop every window of the clinic"""
+        self._generations[clinic_id] = self.generation(clinic_id) + 1
+        if self.settle > 0:
+            self._written_at[clinic_id] = time.monotonic()
+        self._windows.pop(clinic_id, None)
+
+    def evict(self, clinic_id: int) -> None:
+        """Drop the windows of the clinic keeping its generation"""
+        self._windows.pop(clinic_id, None)
@@ -1,5 +1,6 @@
 """Custom ClientWebSocket"""
 
+import json
 from typing import List, Optional, Union
 
 from fastapi import WebSocket
@@ -8,13 +9,18 @@ from plus_db_agent.models import SchedulerModel
 from plus_db_agent.schemas import BaseSchema
 
 from src.enums import MessageType
+from src.profiling import span
+from src.scheduler.recurrence import Occurrence
 from src.scheduler.schemas import (
+    ConflictSchema,
     CreateUUIDSchema,
     ErrorResponseSchema,
     EventSchema,
     Message,
     ReponseEventsCalendarSchema,
+    ViewWindowSchema,
 )
+from src.scheduler.store import StoredEvent
 
 
 class ClientWebSocket:
@@ -24,10 +30,13 @@ class ClientWebSocket:
     clinic_id: int
     uuid: str
     user_id: Optional[int] = None
+    last_write_at: Optional[float] = None
     wb: WebSocket
+    windows: List[ViewWindowSchema]
 
     def __init__(self, wb: WebSocket) -> None:
         self.wb = wb
+        self.windows = []
 
     async def accept(
         self,
@@ -67,20 +76,34 @@ class ClientWebSocket:
             )
         )
 
+    async def send_conflict(self, error: str, event: Optional[EventSchema]) -> None:
+        """Send conflict"""
+        await self.send(
+            Message(
+                messageType=MessageType.CONFLICT,
+                clinicId=self.clinic_id,
+                data=ConflictSchema(error=error, event=event),
+            )
+        )
+
     async def send(self, message: Union[Message, dict]) -> None:
         """Send message"""
-        if isinstance(message, BaseSchema):
-            await self.wb.send_json(message.model_dump())
-        else:
-            await self.wb.send_json(message)
+        with span("encode"):
+            if isinstance(message, BaseSchema):
+                message = message.model_dump(mode="json")
+            text = json.dumps(message, separators=(",", ":"), ensure_ascii=False)
+        await self.wb.send_text(text)
 
-    async def send_events_calendar(self, events: List[SchedulerModel]) -> None:
+    async def send_events_calendar(
+        self, events: List[Union[SchedulerModel, StoredEvent, Occurrence]]
+    ) -> None:
         """Send full month calendar"""
-        scheduler_events: List[EventSchema] = []
-        for event in events:
-            scheduler_events.append(
+        with span("encode"):
+            scheduler_events: List[EventSchema] = [
                 EventSchema(
                     id=event.id,
+                    version=getattr(event, "version", None),
+                    recurrence_id=getattr(event, "recurrence_id", None),
                     date=event.date,
                     description=event.description,
                     is_return=event.is_return,
@@ -89,7 +112,8 @@ class ClientWebSocket:
                     patient=event.patient,
                     desk=event.desk,
                 )
-            )
+                for event in sorted(events, key=lambda event: event.date)
+            ]
         await self.send(
             Message(
                 messageType=MessageType.GET_FULL_MONTH_CALENDAR,
@@ -0,0 +1,267 @@
+"""Streaming export of clinic schedules"""
+
+import csv
+import io
+from datetime import date, datetime, time, timedelta, timezone
+from typing import AsyncGenerator, Iterable, List, Optional, Tuple, Type
+
+from plus_db_agent.models import SchedulerModel
+from tortoise.backends.base.client import BaseDBAsyncClient
+from tortoise.expressions import Q
+from tortoise.models import Model
+
+from src.database import get_read_connection
+from src.enums import ExportFormat, RecurrenceFrequency
+from src.models import RecurrenceExceptionModel, RecurrenceModel
+from src.scheduler.recurrence import get_window_occurrences
+from src.utils import get_day_start, get_month_windows, to_utc
+
+EXPORT_PAGE_SIZE = 500
+
+EVENT_COLUMNS = (
+    "id",
+    "date",
+    "status",
+    "description",
+    "is_return",
+    "is_off",
+    "off_reason",
+    "patient",
+    "desk",
+)
+RECURRENCE_COLUMNS = EVENT_COLUMNS + ("frequency", "interval", "until", "count")
+CSV_HEADER = EVENT_COLUMNS + ("recurrence_id",)
+
+CONTENT_TYPES = {
+    ExportFormat.ICS: "text/calendar; charset=utf-8",
+    ExportFormat.CSV: "text/csv; charset=utf-8",
+}
+
+
+async def iter_pages(
+    model: Type[Model],
+    columns: Tuple[str, ...],
+    order_field: str,
+    *conditions: Q,
+    using_db: Optional[BaseDBAsyncClient] = None,
+    **filters,
+) -> AsyncGenerator[List[tuple], None]:
+    """Yield projected rows page by page using keyset pagination
+
+    Rows are ordered by (order_field, id) and each page resumes after the last
+    row of the previous one, so no page costs more than the first.
+    """
+    order_index = columns.index(order_field)
+    id_index = columns.index("id")
+    cursor: Optional[Q] = None
+    while True:
+        query = model.filter(*conditions, **filters).using_db(using_db)
+        if cursor is not None:
+            query = query.filter(cursor)
+        rows = (
+            await query.order_by(order_field, "id")
+            .limit(EXPORT_PAGE_SIZE)
+            .values_list(*columns)
+        )
+        if not rows:
+            return
+        yield rows
+        if len(rows) < EXPORT_PAGE_SIZE:
+            return
+        last_order, last_id = rows[-1][order_index], rows[-1][id_index]
+        cursor = Q(**{f"{order_field}__gt": last_order}) | Q(
+            **{order_field: last_order, "id__gt": last_id}
+        )
+
+
+def _plain(value):
+    """Return the raw value of enum members"""
+    return getattr(value, "value", value)
+
+
+def _csv_row(values: Iterable, recurrence_id: Optional[int] = None) -> tuple:
+    """Render a projected event row as a CSV record"""
+    record = [_plain(value) for value in values]
+    record[1] = record[1].isoformat()
+    record.append(recurrence_id)
+    return tuple(record)
+
+
+def _ics_escape(value: Optional[str]) -> str:
+    """Escape a text value according to RFC 5545"""
+    if not value:
+        return ""
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace(";", "\\;")
+        .replace(",", "\\,")
+        .replace("\r\n", "\\n")
+        .replace("\n", "\\n")
+    )
+
+
+def _ics_datetime(value: datetime) -> str:
+    """Format a datetime as an iCalendar UTC date-time"""
+    return to_utc(value).strftime("%Y%m%dT%H%M%SZ")
+
+
+def _ics_lines(lines: Iterable[str]) -> str:
+    """Join content lines folding the ones longer than 75 octets"""
+    folded: List[str] = []
+    for line in lines:
+        while len(line.encode("utf-8")) > 75:
+            cut = 75
+            while len(line[:cut].encode("utf-8")) > 75:
+                cut -= 1
+            folded.append(line[:cut])
+            line = " " + line[cut:]
+        folded.append(line)
+    return "".join(f"{line}\r\n" for line in folded)
+
+
+def _ics_event(uid: str, row: tuple, extra: Iterable[str] = ()) -> str:
+    """Render a VEVENT from a projected row"""
+    values = dict(zip(EVENT_COLUMNS, row))
+    summary = values["off_reason"] if values["is_off"] else values["patient"]
+    categories = []
+    if values["is_return"]:
+        categories.append("RETURN")
+    if values["is_off"]:
+        categories.append("OFF")
+    lines = [
+        "BEGIN:VEVENT",
+        f"UID:{uid}",
+        f"DTSTAMP:{_ics_datetime(datetime.now(timezone.utc))}",
+        f"DTSTART:{_ics_datetime(values['date'])}",
+        f"SUMMARY:{_ics_escape(summary)}",
+        f"DESCRIPTION:{_ics_escape(values['description'])}",
+        f"LOCATION:{_ics_escape(values['desk'])}",
+        f"X-PLUS-STATUS:{_ics_escape(_plain(values['status']))}",
+    ]
+    if categories:
+        lines.append(f"CATEGORIES:{','.join(categories)}")
+    lines.extend(extra)
+    lines.append("END:VEVENT")
+    return _ics_lines(lines)
+
+
+def _ics_rrule(
+    frequency: RecurrenceFrequency, interval, until, count, start: datetime
+) -> str:
+    """Render the RRULE property of a recurrence
+
+    Occurrences are expanded on the dates of the stored start, so UNTIL is the
+    end of that day in the start timezone.
+    """
+    rule = f"RRULE:FREQ={RecurrenceFrequency(frequency).value};INTERVAL={interval}"
+    if until:
+        until_end = datetime.combine(until, time(23, 59, 59), start.tzinfo)
+        rule += f";UNTIL={_ics_datetime(until_end)}"
+    if count:
+        rule += f";COUNT={count}"
+    return rule
+
+
+async def _export_ics(
+    clinic_id: int, start: date, end: date
+) -> AsyncGenerator[str, None]:
+    """Yield the iCalendar document of the clinic schedule"""
+    using_db = get_read_connection()
+    yield _ics_lines(
+        [
+            "BEGIN:VCALENDAR",
+            "VERSION:2.0",
+            "PRODID:-//Plus Planner//Scheduler//PT-BR",
+            "CALSCALE:GREGORIAN",
+        ]
+    )
+    async for rows in iter_pages(
+        SchedulerModel,
+        EVENT_COLUMNS,
+        "date",
+        using_db=using_db,
+        clinic_id=clinic_id,
+        date__gte=get_day_start(start),
+        date__lt=get_day_start(end + timedelta(days=1)),
+    ):
+        yield "".join(_ics_event(f"event-{row[0]}@plusplanner", row) for row in rows)
+    async for rows in iter_pages(
+        RecurrenceModel,
+        tuple("start" if column == "date" else column for column in RECURRENCE_COLUMNS),
+        "start",
+        Q(until__isnull=True) | Q(until__gte=start),
+        using_db=using_db,
+        clinic_id=clinic_id,
+        start__lt=get_day_start(end + timedelta(days=1)),
+    ):
+        exceptions = {}
+        for recurrence_id, skipped_date in await (
+            RecurrenceExceptionModel.filter(recurrence_id__in=[row[0] for row in rows])
+            .using_db(using_db)
+            .values_list("recurrence_id", "date")
+        ):
+            exceptions.setdefault(recurrence_id, []).append(skipped_date)
+        chunk = []
+        for row in rows:
+            event_row, rule = row[: len(EVENT_COLUMNS)], row[len(EVENT_COLUMNS) :]
+            start_at = event_row[1]
+            extra = [_ics_rrule(*rule, start_at)]
+            extra.extend(
+                f"EXDATE:{_ics_datetime(datetime.combine(skipped, start_at.timetz()))}"
+                for skipped in sorted(exceptions.get(row[0], ()))
+            )
+            chunk.append(
+                _ics_event(f"recurrence-{row[0]}@plusplanner", event_row, extra)
+            )
+        yield "".join(chunk)
+    yield _ics_lines(["END:VCALENDAR"])
+
+
+async def _export_csv(
+    clinic_id: int, start: date, end: date
+) -> AsyncGenerator[str, None]:
+    """Yield the CSV document of the clinic schedule"""
+    using_db = get_read_connection()
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(CSV_HEADER)
+    yield buffer.getvalue()
+    async for rows in iter_pages(
+        SchedulerModel,
+        EVENT_COLUMNS,
+        "date",
+        using_db=using_db,
+        clinic_id=clinic_id,
+        date__gte=get_day_start(start),
+        date__lt=get_day_start(end + timedelta(days=1)),
+    ):
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(_csv_row(row) for row in rows)
+        yield buffer.getvalue()
+    for window_start, window_end in get_month_windows(start, end):
+        occurrences = await get_window_occurrences(
+            clinic_id, window_start, window_end, using_db
+        )
+        if not occurrences:
+            continue
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(
+            _csv_row(
+                (getattr(occurrence, column) for column in EVENT_COLUMNS),
+                occurrence.recurrence_id,
+            )
+            for occurrence in occurrences
+        )
+        yield buffer.getvalue()
+
+
+def export_schedule(
+    clinic_id: int, start: date, end: date, export_format: ExportFormat
+) -> AsyncGenerator[str, None]:
+    """Return the async generator streaming the clinic schedule"""
+    if export_format == ExportFormat.ICS:
+        return _export_ics(clinic_id, start, end)
+    return _export_csv(clinic_id, start, end)
@@ -0,0 +1,140 @@
+"""Priority-aware fair queue of incoming messages"""
+
+import asyncio
+import heapq
+import itertools
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from src.enums import MessagePriority, MessageType
+
+MESSAGE_PRIORITIES = {
+    MessageType.CONNECTION: MessagePriority.HANDSHAKE,
+    MessageType.SUBSCRIBE: MessagePriority.HANDSHAKE,
+    MessageType.ADD_EVENT: MessagePriority.WRITE,
+    MessageType.EDIT_EVENT: MessagePriority.WRITE,
+    MessageType.REMOVE_EVENT: MessagePriority.WRITE,
+    MessageType.ADD_RECURRENCE: MessagePriority.WRITE,
+    MessageType.REMOVE_RECURRENCE: MessagePriority.WRITE,
+    MessageType.SKIP_OCCURRENCE: MessagePriority.WRITE,
+    MessageType.DETACH_OCCURRENCE: MessagePriority.WRITE,
+}
+MESSAGE_COSTS = {
+    MessageType.GET_FULL_MONTH_CALENDAR: 4.0,
+    MessageType.GET_FULL_WEEK_CALENDAR: 2.0,
+}
+WAIT_SAMPLES = 1024
+
+
+class WaitStats:
+    """Wait time statistics of a priority class"""
+
+    __slots__ = ("count", "total", "max", "samples")
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.samples: Deque[float] = deque(maxlen=WAIT_SAMPLES)
+
+    def add(self, wait: float) -> None:
+        """Record the wait of a processed message"""
+        self.count += 1
+        self.total += wait
+        self.max = max(self.max, wait)
+        self.samples.append(wait)
+
+    def snapshot(self) -> Dict[str, float]:
+        """Return the statistics in seconds, percentiles over recent messages"""
+        samples = sorted(self.samples)
+
+        def percentile(rank: float) -> float:
+            if not samples:
+                return 0.0
+            return samples[min(len(samples) - 1, int(rank * len(samples)))]
+
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else 0.0,
+            "p50": percentile(0.5),
+            "p95": percentile(0.95),
+            "p99": percentile(0.99),
+            "max": self.max,
+        }
+
+
+class FairQueue:
+    """Queue serving priority classes in order and clinics fairly inside each
+
+    Within a class messages are ordered by start-time fair queuing: each clinic
+    advances its own virtual clock by cost / weight per message, so a clinic
+    flooding the queue only delays its own messages. A clinic with weight 2
+    gets twice the share of one with the default weight 1.
+    """
+
+    def __init__(self, weights: Optional[Dict[int, float]] = None) -> None:
+        self.weights: Dict[int, float] = dict(weights or {})
+        self.stats = {priority: WaitStats() for priority in MessagePriority}
+        self._heaps: Dict[MessagePriority, List[tuple]] = {
+            priority: [] for priority in MessagePriority
+        }
+        self._virtual_time = {priority: 0.0 for priority in MessagePriority}
+        self._finish: Dict[Tuple[MessagePriority, int], float] = {}
+        self._pending: Dict[Tuple[MessagePriority, int], int] = {}
+        self._counter = itertools.count()
+        self._not_empty = asyncio.Event()
+        self._size = 0
+
+    def qsize(self) -> int:
+        """Return the number of queued messages"""
+        return self._size
+
+    def empty(self) -> bool:
+        """Return True when there is no queued message"""
+        return self._size == 0
+
+    def put_nowait(self, clinic_id: int, message_type: MessageType, item: Any) -> None:
+        """Queue an item of the clinic"""
+        priority = MESSAGE_PRIORITIES.get(message_type, MessagePriority.READ)
+        key = (priority, clinic_id)
+        start = max(self._virtual_time[priority], self._finish.get(key, 0.0))
+        cost = MESSAGE_COSTS.get(message_type, 1.0)
+        self._finish[key] = start + cost / self.weights.get(clinic_id, 1.0)
+        self._pending[key] = self._pending.get(key, 0) + 1
+        heapq.heappush(
+            self._heaps[priority],
+            (start, next(self._counter), clinic_id, time.monotonic(), item),
+        )
+        self._size += 1
+        self._not_empty.set()
+
+    async def get(self) -> Any:
+        """Wait for and return the next item"""
+        while not self._size:
+            self._not_empty.clear()
+            await self._not_empty.wait()
+        for priority in MessagePriority:
+            heap = self._heaps[priority]
+            if heap:
+                break
+        start, _, clinic_id, queued_at, item = heapq.heappop(heap)
+        self._size -= 1
+        self._virtual_time[priority] = start
+        key = (priority, clinic_id)
+        self._pending[key] -= 1
+        if not self._pending[key]:
+            del self._pending[key]
+            del self._finish[key]
+        self.stats[priority].add(time.monotonic() - queued_at)
+        return item
+
+    def get_stats(self) -> Dict[str, Dict[str, float]]:
+        """Return the wait time statistics of each priority class"""
+        stats = {
+            priority.name.lower(): self.stats[priority].snapshot()
+            for priority in MessagePriority
+        }
+        for priority in MessagePriority:
+            stats[priority.name.lower()]["queued"] = len(self._heaps[priority])
+        return stats
@@ -0,0 +1,280 @@
+"""Bulk import of clinic events"""
+
+import codecs
+import csv
+import json
+from datetime import datetime, timedelta, timezone
+from tempfile import SpooledTemporaryFile
+from typing import AsyncGenerator, AsyncIterator, List, Optional, Set, Tuple, Union
+
+from fastapi import UploadFile
+from plus_db_agent.enums import SchedulerStatus
+from plus_db_agent.models import SchedulerModel
+from pydantic import ValidationError
+from tortoise.exceptions import IntegrityError, OperationalError
+from tortoise.timezone import get_timezone, get_use_tz, is_naive, make_aware
+from tortoise.transactions import in_transaction
+
+from src.enums import ImportFormat, MessageType
+from src.scheduler.manager import ConnectionManager
+from src.scheduler.schemas import AddEventSchema, CalendarInvalidatedSchema, Message
+from src.utils import get_day_start
+
+IMPORT_BATCH_SIZE = 500
+IMPORT_INSERT_CHUNK = 100
+IMPORT_SPOOL_SIZE = 1024 * 1024
+IMPORT_READ_SIZE = 64 * 1024
+
+Record = Tuple[int, Union[dict, str]]
+RowError = Tuple[int, str]
+
+
+async def spool_stream(chunks: AsyncIterator[bytes]) -> UploadFile:
+    """Read the whole stream into a temporary file, kept in memory while small
+
+    The request body must be read before the streaming response starts, the
+    response listens for the disconnect on the same receive channel and would
+    take body chunks away from the reader.
+    """
+    upload = UploadFile(SpooledTemporaryFile(max_size=IMPORT_SPOOL_SIZE))
+    async for chunk in chunks:
+        await upload.write(chunk)
+    await upload.seek(0)
+    return upload
+
+
+async def iter_spooled(upload: UploadFile) -> AsyncGenerator[bytes, None]:
+    """Read back a spooled stream, closing it at the end"""
+    try:
+        while chunk := await upload.read(IMPORT_READ_SIZE):
+            yield chunk
+    finally:
+        await upload.close()
+
+
+async def iter_lines(chunks: AsyncIterator[bytes]) -> AsyncGenerator[str, None]:
+    """Split a stream of utf-8 bytes into lines"""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    pending = ""
+    async for chunk in chunks:
+        pending += decoder.decode(chunk)
+        *lines, pending = pending.split("\n")
+        for line in lines:
+            yield line.rstrip("\r")
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending.rstrip("\r")
+
+
+async def iter_records(
+    lines: AsyncIterator[str], import_format: ImportFormat
+) -> AsyncGenerator[Record, None]:
+    """Yield (row number, record) pairs, the record is an error message when
+    the row cannot be parsed"""
+    row = 0
+    if import_format == ImportFormat.NDJSON:
+        async for line in lines:
+            if not line.strip():
+                continue
+            row += 1
+            try:
+                record = json.loads(line)
+            except ValueError:
+                yield row, "JSON inválido"
+                continue
+            yield row, record if isinstance(record, dict) else "JSON inválido"
+        return
+
+    header: Optional[List[str]] = None
+    pending = ""
+    async for line in lines:
+        pending = f"{pending}\n{line}" if pending else line
+        if pending.count('"') % 2:
+            # quoted field spanning several lines
+            continue
+        record, pending = pending, ""
+        if not record.strip():
+            continue
+        values = next(csv.reader([record]))
+        if header is None:
+            header = [value.strip() for value in values]
+            continue
+        row += 1
+        yield row, {
+            key: value for key, value in zip(header, values) if value.strip() != ""
+        }
+    if pending:
+        yield row + 1, "CSV inválido"
+
+
+async def iter_batches(
+    records: AsyncIterator[Record],
+) -> AsyncGenerator[List[Record], None]:
+    """Group records in batches of IMPORT_BATCH_SIZE"""
+    batch: List[Record] = []
+    async for record in records:
+        batch.append(record)
+        if len(batch) == IMPORT_BATCH_SIZE:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _format_validation_error(error: ValidationError) -> str:
+    """Flatten a pydantic error into a single message"""
+    messages = []
+    for detail in error.errors():
+        location = ".".join(str(part) for part in detail["loc"])
+        message = detail["msg"].removeprefix("Value error, ")
+        messages.append(f"{location}: {message}" if location else message)
+    return "; ".join(messages)
+
+
+def _slot(desk: str, value: datetime) -> Tuple[str, datetime]:
+    """Return the desk booking slot with the date as aware UTC
+
+    Naive dates are read as Tortoise stores them, in UTC with use_tz and in
+    the configured timezone otherwise.
+    """
+    if is_naive(value):
+        value = make_aware(value, "UTC" if get_use_tz() else get_timezone())
+    return desk, value.astimezone(timezone.utc)
+
+
+async def _validate_batch(
+    clinic_id: int, batch: List[Record], booked: Set[Tuple[str, datetime]]
+) -> Tuple[List[Tuple[int, AddEventSchema]], List[RowError]]:
+    """Validate a batch of records with the AddEventSchema rules
+
+    Besides the schema, an event is rejected when its desk is already booked
+    at the same time, either by a previous row of the import or in the
+    database. The database is read by whole days around the batch and the
+    slots are compared as aware UTC dates.
+    """
+    candidates: List[Tuple[int, AddEventSchema]] = []
+    errors: List[RowError] = []
+    for row, record in batch:
+        if isinstance(record, str):
+            errors.append((row, record))
+            continue
+        record.setdefault("clinicId", clinic_id)
+        try:
+            event = AddEventSchema.model_validate(record)
+        except ValidationError as error:
+            errors.append((row, _format_validation_error(error)))
+            continue
+        if event.clinic_id != clinic_id:
+            errors.append((row, "Clínica divergente"))
+            continue
+        candidates.append((row, event))
+
+    slots = [_slot(event.desk, event.date) for _, event in candidates]
+    if slots:
+        first_day = min(value for _, value in slots).date() - timedelta(days=1)
+        last_day = max(value for _, value in slots).date() + timedelta(days=1)
+        booked.update(
+            _slot(desk, value)
+            for desk, value in await SchedulerModel.filter(
+                clinic_id=clinic_id,
+                desk__in=list({desk for desk, _ in slots}),
+                date__gte=get_day_start(first_day),
+                date__lt=get_day_start(last_day + timedelta(days=1)),
+            ).values_list("desk", "date")
+        )
+
+    valid: List[Tuple[int, AddEventSchema]] = []
+    for (row, event), slot in zip(candidates, slots):
+        if slot in booked:
+            errors.append((row, "Consultório ocupado neste horário"))
+            continue
+        booked.add(slot)
+        valid.append((row, event))
+    return valid, errors
+
+
+async def _insert_batch(
+    clinic_id: int, events: List[AddEventSchema], user_id: Optional[int]
+) -> None:
+    """Insert the validated events in a single transaction"""
+    async with in_transaction("default"):
+        await SchedulerModel.bulk_create(
+            [
+                SchedulerModel(
+                    status=SchedulerStatus.WAITING_CONFIRMATION.value,
+                    date=event.date,
+                    description=event.description,
+                    is_return=event.is_return,
+                    is_off=event.is_off,
+                    off_reason=event.off_reason,
+                    clinic_id=clinic_id,
+                    patient=event.patient,
+                    user=user_id,
+                    desk=event.desk,
+                )
+                for event in events
+            ],
+            batch_size=IMPORT_INSERT_CHUNK,
+        )
+
+
+def _progress(**data) -> str:
+    """Render a progress line"""
+    return json.dumps(data, ensure_ascii=False) + "\n"
+
+
+async def import_events(
+    clinic_id: int,
+    chunks: AsyncIterator[bytes],
+    import_format: ImportFormat,
+    user_id: Optional[int] = None,
+) -> AsyncGenerator[str, None]:
+    """Import the events of the stream yielding NDJSON progress lines
+
+    Each batch is validated and inserted on its own, a progress line with the
+    row errors is yielded after it. Once the stream ends the clinic receives a
+    single CALENDAR_INVALIDATED notice covering the imported dates.
+    """
+    processed = imported = failed = 0
+    first_date: Optional[datetime] = None
+    last_date: Optional[datetime] = None
+    booked: Set[Tuple[str, datetime]] = set()
+    records = iter_records(iter_lines(chunks), import_format)
+
+    async for batch in iter_batches(records):
+        valid, errors = await _validate_batch(clinic_id, batch, booked)
+        if valid:
+            try:
+                await _insert_batch(clinic_id, [event for _, event in valid], user_id)
+                dates = [event.date for _, event in valid]
+                first_date = min([first_date, *dates] if first_date else dates)
+                last_date = max([last_date, *dates] if last_date else dates)
+                imported += len(valid)
+            except (OperationalError, IntegrityError):
+                booked.difference_update(
+                    _slot(event.desk, event.date) for _, event in valid
+                )
+                errors.extend((row, "Erro ao importar o evento") for row, _ in valid)
+        processed += len(batch)
+        failed += len(errors)
+        yield _progress(
+            processed=processed,
+            imported=imported,
+            errors=[{"row": row, "error": error} for row, error in sorted(errors)],
+        )
+
+    if imported:
+        ConnectionManager().invalidate_clinic(clinic_id)
+        await ConnectionManager().broadcast_clinic_messages(
+            clinic_id,
+            Message(
+                message_type=MessageType.CALENDAR_INVALIDATED,
+                clinic_id=clinic_id,
+                data=CalendarInvalidatedSchema(
+                    first_date=first_date.date(),
+                    last_date=last_date.date(),
+                    imported=imported,
+                ),
+            ),
+        )
+    yield _progress(done=True, processed=processed, imported=imported, failed=failed)
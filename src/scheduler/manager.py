@@ -5,33 +5,68 @@ import json
 import logging
 import time
 import uuid
-from datetime import datetime
-from threading import Thread
-from typing import List
+from calendar import monthrange
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Union
 
 from fastapi import WebSocket
 from fastapi.websockets import WebSocketDisconnect, WebSocketState
 from plus_db_agent.enums import SchedulerStatus
 from plus_db_agent.models import SchedulerModel
-from tortoise.exceptions import OperationalError
+from tortoise.exceptions import IntegrityError, OperationalError
+from tortoise.transactions import in_transaction
 from typing_extensions import Self
 
-from src.backends import check_clinic_id
+from src.backends import (
+    EDITABLE_EVENT_FIELDS,
+    EVENT_COLUMNS,
+    clinic_ids,
+    delete_event_if_version,
+    update_event_if_version,
+)
+from src.config import (
+    CALENDAR_CACHE_MAX_WINDOWS,
+    CALENDAR_CACHE_TTL,
+    CLINIC_WEIGHTS,
+    EVENT_STORE,
+    EVENT_STORE_TTL,
+    READ_YOUR_WRITES_SECONDS,
+)
+from src.database import get_read_connection
 from src.enums import MessageType
-from src.scheduler.api_client import APIClient
+from src.models import RecurrenceExceptionModel, RecurrenceModel
+from src.profiling import Trace, current_trace, span, tracer
+from src.scheduler.analytics import invalidate_analytics
+from src.scheduler.api_client import get_api_client
+from src.scheduler.cache import WindowCache
 from src.scheduler.client import ClientWebSocket
+from src.scheduler.fair_queue import FairQueue
+from src.scheduler.recurrence import (
+    Occurrence,
+    expand_rule,
+    get_window_occurrences,
+)
 from src.scheduler.schemas import (
     AddEventSchema,
+    AddRecurrenceSchema,
     ConnectionSchema,
+    DetachedOccurrenceSchema,
     EditEventSchema,
     EventSchema,
+    EventValuesSchema,
     GetDayCalendarSchema,
     GetFullMonthCalendarSchema,
     GetFullWeekCalendarSchema,
     Message,
+    RecurrenceSchema,
     RemoveEventSchema,
+    RemoveRecurrenceSchema,
+    SkipOccurrenceSchema,
+    SubscribeSchema,
 )
-from src.utils import get_week
+from src.scheduler.store import EventStore, StoredEvent
+from src.scheduler.subscriptions import SubscriptionTable
+from src.utils import get_day_start, get_week
 
 logger = logging.getLogger(__name__)
 
@@ -41,8 +76,20 @@ class ConnectionManager:
 
     _instance: "ConnectionManager" = None
     client_connections: List[ClientWebSocket] = []
-    queue = asyncio.Queue()
-    api_client = APIClient()
+    # connections per clinic, and the ones without view windows that receive
+    # every message of the clinic
+    clinic_connections: Dict[int, List[ClientWebSocket]] = {}
+    unfiltered_connections: Dict[int, List[ClientWebSocket]] = {}
+    queue: Optional[FairQueue] = None
+    processor: Optional[asyncio.Task] = None
+    subscriptions = SubscriptionTable()
+    calendar_cache = WindowCache(
+        CALENDAR_CACHE_TTL, CALENDAR_CACHE_MAX_WINDOWS, READ_YOUR_WRITES_SECONDS
+    )
+    event_store = EventStore(EVENT_STORE, EVENT_STORE_TTL)
+    occurrence_cache = WindowCache(
+        CALENDAR_CACHE_TTL, CALENDAR_CACHE_MAX_WINDOWS, READ_YOUR_WRITES_SECONDS
+    )
 
     def __new__(cls) -> Self:
         """Singleton instance"""
@@ -53,11 +100,13 @@ class ConnectionManager:
     async def connect(self, websocket: WebSocket, clinic_id: int):
         """Add a new client connection to the list on connect"""
         client_websocket = ClientWebSocket(wb=websocket)
-        if await check_clinic_id(clinic_id):
+        if await clinic_ids.exists(clinic_id):
             new_uuid = uuid.uuid4().hex
             await client_websocket.accept(client_id=clinic_id, uuid_code=new_uuid)
             await client_websocket.send_new_uuid(new_uuid)
             self.client_connections.append(client_websocket)
+            self.clinic_connections.setdefault(clinic_id, []).append(client_websocket)
+            self.__set_unfiltered(client_websocket, True)
             await self.__listenner(client_websocket)
         else:
             if client_websocket.wb.state == WebSocketState.CONNECTED:
@@ -72,7 +121,7 @@ class ConnectionManager:
                         data={"error": "Token inválido ou clínica inexistente"},
                     )
                 )
-            time.sleep(0.1)
+            await asyncio.sleep(0.1)
             await websocket.close()
             await client_websocket.close()
 
@@ -80,6 +129,11 @@ class ConnectionManager:
         """Remove a client connection from the list on disconnect"""
         if client in self.client_connections:
             self.client_connections.remove(client)
+        self.__discard(self.clinic_connections, client)
+        self.__set_unfiltered(client, False)
+        self.subscriptions.unsubscribe(client)
+        if self.get_connection_by_clinic_id(client.clinic_id) is None:
+            self.event_store.drop(client.clinic_id)
         if client.wb.state == WebSocketState.CONNECTED:
             await client.close()
 
@@ -96,30 +150,204 @@ class ConnectionManager:
 
     def get_connection_by_clinic_id(self, clinic_id: int) -> ClientWebSocket:
         """Return connection by clinic_id"""
-        for connection in self.client_connections:
-            if connection.clinic_id == clinic_id:
-                return connection
-        return None
+        connections = self.clinic_connections.get(clinic_id)
+        return connections[0] if connections else None
+
+    @staticmethod
+    def __discard(
+        connections: Dict[int, List[ClientWebSocket]], client: ClientWebSocket
+    ) -> None:
+        """Remove the client from its clinic list, dropping empty lists"""
+        clinic_connections = connections.get(client.clinic_id)
+        if clinic_connections is None or client not in clinic_connections:
+            return
+        clinic_connections.remove(client)
+        if not clinic_connections:
+            del connections[client.clinic_id]
+
+    def __set_unfiltered(self, client: ClientWebSocket, unfiltered: bool) -> None:
+        """Track whether the client receives every message of its clinic"""
+        if not unfiltered:
+            self.__discard(self.unfiltered_connections, client)
+            return
+        connections = self.unfiltered_connections.setdefault(client.clinic_id, [])
+        if client not in connections:
+            connections.append(client)
+
+    async def broadcast_clinic_messages(
+        self,
+        clinic_id: int,
+        message: Message,
+        dates: Optional[Iterable[Union[date, datetime]]] = None,
+        desk: Optional[str] = None,
+    ) -> None:
+        """Broadcast messages
+
+        When the event dates are informed, clients that registered view windows
+        only receive the message if one of their windows intersects those dates.
+        Clients without windows keep receiving every message of the clinic.
+        """
+        with span("fan_out"):
+            await self.__send_to_clinic(clinic_id, message, dates, desk)
+
+    async def __send_to_clinic(
+        self,
+        clinic_id: int,
+        message: Message,
+        dates: Optional[Iterable[Union[date, datetime]]],
+        desk: Optional[str],
+    ) -> None:
+        """Send the message to the clinic connections interested in it
 
-    async def broadcast_clinic_messages(self, clinic_id: int, message: Message) -> None:
-        """Broadcast messages"""
-        for client_connection in self.client_connections:
-            if client_connection.clinic_id == clinic_id:
-                await client_connection.send(message)
+        Only the matching subscribers and the clinic connections without
+        windows are visited.
+        """
+        if dates is None:
+            recipients = list(self.clinic_connections.get(clinic_id, ()))
+        else:
+            recipients = [
+                *self.subscriptions.match(clinic_id, dates, desk),
+                *self.unfiltered_connections.get(clinic_id, ()),
+            ]
+        for client_connection in recipients:
+            await client_connection.send(message)
 
     async def __listenner(self, websocket_client: ClientWebSocket) -> None:
         """Listen to incoming messages"""
         try:
             while True:
-                data = await websocket_client.wb.receive_json()
+                text = await websocket_client.wb.receive_text()
+                trace = tracer.new_trace()
                 try:
-                    message = Message.model_validate_json(json.dumps(data))
-                    await self.queue.put((websocket_client, message))
+                    if trace is None:
+                        message = Message.model_validate_json(text)
+                    else:
+                        with trace.span("receive"):
+                            data = json.loads(text)
+                        with trace.span("validate"):
+                            message = Message.model_validate(data)
+                        trace.message_type = message.message_type
+                        trace.clinic_id = websocket_client.clinic_id
+                        trace.enqueued_at = time.monotonic()
+                    self.queue.put_nowait(
+                        websocket_client.clinic_id,
+                        message.message_type,
+                        (websocket_client, message, trace),
+                    )
                 except (ValueError, AttributeError):
                     await websocket_client.send_invalid_message()
                     continue
         except WebSocketDisconnect:
-            self.disconnect(websocket_client)
+            await self.disconnect(websocket_client)
+
+    async def __get_window_events(
+        self,
+        clinic_id: int,
+        window_start: date,
+        window_end: date,
+        last_write_at: Optional[float] = None,
+    ) -> List[Union[SchedulerModel, StoredEvent, Occurrence]]:
+        """Return the events and recurring occurrences inside the inclusive window
+
+        Reads go to a replica unless the requesting client wrote recently.
+        """
+        if (
+            self.event_store.enabled
+            and self.get_connection_by_clinic_id(clinic_id) is not None
+        ):
+            return await self.__get_stored_window_events(
+                clinic_id, window_start, window_end, last_write_at
+            )
+        window = (window_start, window_end)
+        cached = self.calendar_cache.get(clinic_id, window)
+        if cached is not None:
+            return cached
+        generation = self.calendar_cache.generation(clinic_id)
+        using_db = get_read_connection(last_write_at)
+        with span("db"):
+            scheduler_events: List[Union[SchedulerModel, Occurrence]] = list(
+                await SchedulerModel.filter(
+                    clinic_id=clinic_id,
+                    date__gte=get_day_start(window_start),
+                    date__lt=get_day_start(window_end + timedelta(days=1)),
+                )
+                .using_db(using_db)
+                .all()
+            )
+            scheduler_events.extend(
+                await get_window_occurrences(
+                    clinic_id, window_start, window_end, using_db
+                )
+            )
+        self.calendar_cache.set(clinic_id, window, scheduler_events, generation)
+        return scheduler_events
+
+    async def __get_stored_window_events(
+        self,
+        clinic_id: int,
+        window_start: date,
+        window_end: date,
+        last_write_at: Optional[float] = None,
+    ) -> List[Union[StoredEvent, Occurrence]]:
+        """Return the window events of an active clinic from the event store
+
+        Missing months are loaded as projected rows, only the recurring
+        occurrences of the window are cached apart.
+        """
+        clinic_events = self.event_store.get(clinic_id)
+        write_times = [
+            written_at
+            for written_at in (last_write_at, clinic_events.written_at)
+            if written_at is not None
+        ]
+        using_db = get_read_connection(max(write_times) if write_times else None)
+        window = (window_start, window_end)
+        occurrences = self.occurrence_cache.get(clinic_id, window)
+        with span("db"):
+            for month_start, month_end in clinic_events.missing_months(
+                window_start, window_end
+            ):
+                rows = (
+                    await SchedulerModel.filter(
+                        clinic_id=clinic_id,
+                        date__gte=get_day_start(month_start),
+                        date__lt=get_day_start(month_end + timedelta(days=1)),
+                    )
+                    .using_db(using_db)
+                    .values_list(*EVENT_COLUMNS)
+                )
+                clinic_events.load(month_start, rows)
+            if occurrences is None:
+                generation = self.occurrence_cache.generation(clinic_id)
+                occurrences = await get_window_occurrences(
+                    clinic_id, window_start, window_end, using_db
+                )
+                self.occurrence_cache.set(clinic_id, window, occurrences, generation)
+        return [*clinic_events.window(window_start, window_end), *occurrences]
+
+    async def preload_window(
+        self, clinic_id: int, window_start: date, window_end: date
+    ) -> None:
+        """Load the calendar window into the cache"""
+        await self.__get_window_events(clinic_id, window_start, window_end)
+
+    def __register_write(self, client: ClientWebSocket, clinic_id: int) -> None:
+        """Mark the write of the client and drop the cached data of the clinic
+
+        The event store is kept, the handlers apply their writes to it.
+        """
+        client.last_write_at = time.monotonic()
+        self.event_store.mark_write(clinic_id)
+        self.calendar_cache.invalidate(clinic_id)
+        self.occurrence_cache.invalidate(clinic_id)
+        invalidate_analytics(clinic_id)
+
+    def invalidate_clinic(self, clinic_id: int) -> None:
+        """Drop the stored events, cached calendars and analytics of the clinic"""
+        self.event_store.drop(clinic_id)
+        self.calendar_cache.invalidate(clinic_id)
+        self.occurrence_cache.invalidate(clinic_id)
+        invalidate_analytics(clinic_id)
 
     async def __process_full_month_calendar(
         self, message: Message, client: ClientWebSocket
@@ -131,11 +359,13 @@ class ConnectionManager:
         current_date = datetime.strptime(
             f"{message.data.year}-{message.data.month}-01", "%Y-%m-%d"
         ).date()
-        scheduler_events = await SchedulerModel.filter(
-            clinic_id=message.clinic_id,
-            date__month=current_date.month,
-            date__year=current_date.year,
-        ).all()
+        _, last_day = monthrange(current_date.year, current_date.month)
+        scheduler_events = await self.__get_window_events(
+            message.clinic_id,
+            current_date,
+            current_date.replace(day=last_day),
+            client.last_write_at,
+        )
         await client.send_events_calendar(scheduler_events)
 
     async def __process_full_week_calendar(
@@ -148,10 +378,10 @@ class ConnectionManager:
         current_date = datetime.strptime(
             f"{message.data.year}-{message.data.month}-{message.data.day}", "%Y-%m-%d"
         ).date()
-        week, _, _ = get_week(current_date)
-        scheduler_events = await SchedulerModel.filter(
-            clinic_id=message.clinic_id, date__gte=week[0], date__lte=week[-1]
-        ).all()
+        week = list(get_week(current_date))
+        scheduler_events = await self.__get_window_events(
+            message.clinic_id, week[0], week[-1], client.last_write_at
+        )
         await client.send_events_calendar(scheduler_events)
 
     async def __process_day_calendar(
@@ -161,9 +391,12 @@ class ConnectionManager:
         if not isinstance(message.data, GetDayCalendarSchema):
             await client.send_invalid_message()
             return
-        scheduler_events = await SchedulerModel.filter(
-            clinic_id=message.clinic_id, date__date=message.data.date
-        ).all()
+        scheduler_events = await self.__get_window_events(
+            message.clinic_id,
+            message.data.date,
+            message.data.date,
+            client.last_write_at,
+        )
         await client.send_events_calendar(scheduler_events)
 
     async def __process_add_event(
@@ -174,20 +407,28 @@ class ConnectionManager:
             if not isinstance(message.data, AddEventSchema):
                 await client.send_invalid_message()
                 return
-            new_event = await SchedulerModel.create(
-                status=SchedulerStatus.WAITING_CONFIRMATION.value,
-                date=message.data.date,
-                description=message.data.description,
-                is_return=message.data.is_return,
-                is_off=message.data.is_off,
-                off_reason=message.data.off_reason,
-                clinic_id=message.clinic_id,
-                patient=message.data.patient,
-                user=client.user_id,
-                desk=message.data.desk,
-            )
+            with span("db"):
+                new_event = await SchedulerModel.create(
+                    status=SchedulerStatus.WAITING_CONFIRMATION.value,
+                    date=message.data.date,
+                    description=message.data.description,
+                    is_return=message.data.is_return,
+                    is_off=message.data.is_off,
+                    off_reason=message.data.off_reason,
+                    clinic_id=message.clinic_id,
+                    patient=message.data.patient,
+                    user=client.user_id,
+                    desk=message.data.desk,
+                )
+            self.__register_write(client, message.clinic_id)
+            clinic_events = self.event_store.get_loaded(message.clinic_id)
+            if clinic_events is not None:
+                clinic_events.add(
+                    {column: getattr(new_event, column) for column in EVENT_COLUMNS}
+                )
             new_event_schema = EventSchema(
                 id=new_event.id,
+                version=getattr(new_event, "version", None),
                 date=new_event.date,
                 description=new_event.description,
                 is_return=new_event.is_return,
@@ -201,10 +442,44 @@ class ConnectionManager:
                 clinic_id=message.clinic_id,
                 data=new_event_schema,
             )
-            await self.broadcast_clinic_messages(client.clinic_id, new_message)
+            await self.broadcast_clinic_messages(
+                client.clinic_id, new_message, [new_event.date], new_event.desk
+            )
         except (OperationalError, AttributeError):
             await client.send_error_message("Erro ao adicionar o evento")
 
+    async def __send_conflict(self, event_id: int, client: ClientWebSocket) -> None:
+        """Send the current state of an event a write could not be applied to"""
+        event = await SchedulerModel.get_or_none(
+            id=event_id, clinic_id=client.clinic_id
+        )
+        if event is None:
+            await client.send_conflict("Evento não encontrado", None)
+            return
+        await client.send_conflict(
+            "O evento foi alterado por outro usuário",
+            EventSchema(
+                id=event.id,
+                version=getattr(event, "version", None),
+                date=event.date,
+                description=event.description,
+                is_return=event.is_return,
+                is_off=event.is_off,
+                off_reason=event.off_reason,
+                patient=event.patient,
+                desk=event.desk,
+            ),
+        )
+
+    @staticmethod
+    def __expected_values(
+        previous: Optional[EventValuesSchema],
+    ) -> Optional[Dict[str, Any]]:
+        """Return the previous values informed by the client, by field"""
+        if previous is None:
+            return None
+        return previous.model_dump(include=previous.model_fields_set)
+
     async def __process_edit_event(
         self, message: Message, client: ClientWebSocket
     ) -> None:
@@ -213,27 +488,45 @@ class ConnectionManager:
             if not isinstance(message.data, EditEventSchema):
                 await client.send_invalid_message()
                 return
-            event = await SchedulerModel.get(id=message.data.event_id)
-            for key, value in message.data.model_dump().items():
-                if value and hasattr(event, key):
-                    setattr(event, key, value)
-            await event.save()
+            changes = {
+                key: value
+                for key, value in message.data.model_dump().items()
+                if key in EDITABLE_EVENT_FIELDS
+                and key in message.data.model_fields_set
+                and value is not None
+            }
+            if not changes:
+                await client.send_invalid_message()
+                return
+            with span("db"):
+                row = await update_event_if_version(
+                    message.data.event_id,
+                    message.clinic_id,
+                    changes,
+                    message.data.version,
+                    self.__expected_values(message.data.previous),
+                )
+            if row is None:
+                await self.__send_conflict(message.data.event_id, client)
+                return
+            self.__register_write(client, message.clinic_id)
+            clinic_events = self.event_store.get_loaded(message.clinic_id)
+            if clinic_events is not None:
+                clinic_events.update(row)
             new_event_schema = EventSchema(
-                id=event.id,
-                date=event.date,
-                description=event.description,
-                is_return=event.is_return,
-                is_off=event.is_off,
-                off_reason=event.off_reason,
-                patient=event.patient,
-                desk=event.desk,
+                **{column: row[column] for column in EVENT_COLUMNS}
             )
             new_message = Message(
                 message_type=MessageType.EDIT_EVENT,
                 clinic_id=message.clinic_id,
                 data=new_event_schema,
             )
-            await self.broadcast_clinic_messages(client.clinic_id, new_message)
+            await self.broadcast_clinic_messages(
+                client.clinic_id,
+                new_message,
+                [row["previous_date"], row["date"]],
+                row["desk"] if row["desk"] == row["previous_desk"] else None,
+            )
         except OperationalError:
             await client.send_error_message("Erro ao editar o evento")
 
@@ -245,30 +538,245 @@ class ConnectionManager:
             if not isinstance(message.data, RemoveEventSchema):
                 await client.send_invalid_message()
                 return
-            event = await SchedulerModel.get(id=message.data.event_id)
-            await event.delete()
+            with span("db"):
+                row = await delete_event_if_version(
+                    message.data.event_id,
+                    message.clinic_id,
+                    message.data.version,
+                    self.__expected_values(message.data.previous),
+                )
+            if row is None:
+                await self.__send_conflict(message.data.event_id, client)
+                return
+            self.__register_write(client, message.clinic_id)
+            clinic_events = self.event_store.get_loaded(message.clinic_id)
+            if clinic_events is not None:
+                clinic_events.remove(row["id"], row["date"])
             new_message = Message(
                 message_type=MessageType.REMOVE_EVENT,
                 clinic_id=message.clinic_id,
                 data=message.data,
             )
-            await self.broadcast_clinic_messages(client.clinic_id, new_message)
+            await self.broadcast_clinic_messages(
+                client.clinic_id, new_message, [row["date"]], row["desk"]
+            )
         except OperationalError:
             await client.send_error_message("Erro ao remover o evento")
 
+    async def __process_add_recurrence(
+        self, message: Message, client: ClientWebSocket
+    ) -> None:
+        """Process add recurrence"""
+        try:
+            if not isinstance(message.data, AddRecurrenceSchema):
+                await client.send_invalid_message()
+                return
+            event, rule = message.data.event, message.data.rule
+            recurrence = await RecurrenceModel.create(
+                clinic_id=message.clinic_id,
+                start=event.date,
+                frequency=rule.frequency,
+                interval=rule.interval,
+                until=rule.until,
+                count=rule.count,
+                status=SchedulerStatus.WAITING_CONFIRMATION.value,
+                description=event.description,
+                is_return=event.is_return,
+                is_off=event.is_off,
+                off_reason=event.off_reason,
+                patient=event.patient,
+                desk=event.desk,
+                user=client.user_id,
+            )
+            self.__register_write(client, message.clinic_id)
+            new_message = Message(
+                message_type=MessageType.ADD_RECURRENCE,
+                clinic_id=message.clinic_id,
+                data=RecurrenceSchema(
+                    id=recurrence.id,
+                    rule=rule,
+                    event=EventSchema(
+                        recurrence_id=recurrence.id,
+                        date=recurrence.start,
+                        description=recurrence.description,
+                        is_return=recurrence.is_return,
+                        is_off=recurrence.is_off,
+                        off_reason=recurrence.off_reason,
+                        patient=recurrence.patient,
+                        desk=recurrence.desk,
+                    ),
+                ),
+            )
+            await self.broadcast_clinic_messages(client.clinic_id, new_message)
+        except (OperationalError, AttributeError):
+            await client.send_error_message("Erro ao adicionar a recorrência")
+
+    async def __process_remove_recurrence(
+        self, message: Message, client: ClientWebSocket
+    ) -> None:
+        """Process remove recurrence"""
+        try:
+            if not isinstance(message.data, RemoveRecurrenceSchema):
+                await client.send_invalid_message()
+                return
+            deleted = await RecurrenceModel.filter(
+                id=message.data.recurrence_id, clinic_id=message.clinic_id
+            ).delete()
+            if not deleted:
+                await client.send_error_message("Recorrência não encontrada")
+                return
+            self.__register_write(client, message.clinic_id)
+            new_message = Message(
+                message_type=MessageType.REMOVE_RECURRENCE,
+                clinic_id=message.clinic_id,
+                data=message.data,
+            )
+            await self.broadcast_clinic_messages(client.clinic_id, new_message)
+        except OperationalError:
+            await client.send_error_message("Erro ao remover a recorrência")
+
+    async def __process_skip_occurrence(
+        self, message: Message, client: ClientWebSocket
+    ) -> None:
+        """Process skip occurrence"""
+        try:
+            if not isinstance(message.data, SkipOccurrenceSchema):
+                await client.send_invalid_message()
+                return
+            recurrence = await RecurrenceModel.get_or_none(
+                id=message.data.recurrence_id, clinic_id=message.clinic_id
+            )
+            if recurrence is None:
+                await client.send_error_message("Recorrência não encontrada")
+                return
+            await RecurrenceExceptionModel.get_or_create(
+                recurrence_id=recurrence.id, date=message.data.occurrence_date
+            )
+            self.__register_write(client, message.clinic_id)
+            new_message = Message(
+                message_type=MessageType.SKIP_OCCURRENCE,
+                clinic_id=message.clinic_id,
+                data=message.data,
+            )
+            await self.broadcast_clinic_messages(
+                client.clinic_id,
+                new_message,
+                [message.data.occurrence_date],
+                recurrence.desk,
+            )
+        except OperationalError:
+            await client.send_error_message("Erro ao remover a ocorrência")
+
+    async def __process_detach_occurrence(
+        self, message: Message, client: ClientWebSocket
+    ) -> None:
+        """Process detach occurrence, the occurrence becomes a standalone event"""
+        try:
+            if not isinstance(message.data, SkipOccurrenceSchema):
+                await client.send_invalid_message()
+                return
+            occurrence_date = message.data.occurrence_date
+            recurrence = await RecurrenceModel.get_or_none(
+                id=message.data.recurrence_id, clinic_id=message.clinic_id
+            )
+            if recurrence is None:
+                await client.send_error_message("Recorrência não encontrada")
+                return
+            occurrences = expand_rule(
+                recurrence.start,
+                recurrence.frequency,
+                recurrence.interval,
+                recurrence.until,
+                recurrence.count,
+                occurrence_date,
+                occurrence_date,
+            )
+            if not occurrences or await RecurrenceExceptionModel.exists(
+                recurrence_id=recurrence.id, date=occurrence_date
+            ):
+                await client.send_error_message("Ocorrência não encontrada")
+                return
+            async with in_transaction("default") as connection:
+                await RecurrenceExceptionModel.create(
+                    recurrence_id=recurrence.id,
+                    date=occurrence_date,
+                    using_db=connection,
+                )
+                new_event = await SchedulerModel.create(
+                    status=recurrence.status,
+                    date=occurrences[0],
+                    description=recurrence.description,
+                    is_return=recurrence.is_return,
+                    is_off=recurrence.is_off,
+                    off_reason=recurrence.off_reason,
+                    clinic_id=message.clinic_id,
+                    patient=recurrence.patient,
+                    user=client.user_id,
+                    desk=recurrence.desk,
+                    using_db=connection,
+                )
+            self.__register_write(client, message.clinic_id)
+            clinic_events = self.event_store.get_loaded(message.clinic_id)
+            if clinic_events is not None:
+                clinic_events.add(
+                    {column: getattr(new_event, column) for column in EVENT_COLUMNS}
+                )
+            new_message = Message(
+                message_type=MessageType.DETACH_OCCURRENCE,
+                clinic_id=message.clinic_id,
+                data=DetachedOccurrenceSchema(
+                    recurrence_id=recurrence.id,
+                    occurrence_date=occurrence_date,
+                    event=EventSchema(
+                        id=new_event.id,
+                        version=getattr(new_event, "version", None),
+                        date=new_event.date,
+                        description=new_event.description,
+                        is_return=new_event.is_return,
+                        is_off=new_event.is_off,
+                        off_reason=new_event.off_reason,
+                        patient=new_event.patient,
+                        desk=new_event.desk,
+                    ),
+                ),
+            )
+            await self.broadcast_clinic_messages(
+                client.clinic_id, new_message, [occurrence_date], recurrence.desk
+            )
+        except (OperationalError, IntegrityError):
+            await client.send_error_message("Erro ao separar a ocorrência")
+
+    async def __process_subscribe(
+        self, message: Message, client: ClientWebSocket
+    ) -> None:
+        """Process subscribe"""
+        if not isinstance(message.data, SubscribeSchema):
+            await client.send_invalid_message()
+            return
+        self.subscriptions.subscribe(client, message.data.windows)
+        self.__set_unfiltered(client, not client.windows)
+        await client.send(
+            Message(message_type=MessageType.SUBSCRIBE, clinic_id=client.clinic_id)
+        )
+
     async def __process_connection(self, message: Message, client: ClientWebSocket):
         """Process connection"""
         try:
             if not isinstance(message.data, ConnectionSchema):
                 await client.send_invalid_message()
                 return
-            if not self.api_client.check_is_token_is_valid(message.data.token):
+            api_client = get_api_client()
+            if not await asyncio.to_thread(
+                api_client.check_is_token_is_valid, message.data.token
+            ):
                 await client.send_error_message("Token inválido")
-                time.sleep(0.1)
+                await asyncio.sleep(0.1)
                 await self.disconnect(client)
                 return
-            user_dict = self.api_client.get_user_by_token(client.token)
-            client.token = message
+            user_dict = await asyncio.to_thread(
+                api_client.get_user_by_token, message.data.token
+            )
+            client.token = message.data.token
             client.user_id = user_dict["id"]
             await client.send(
                 Message(
@@ -277,7 +785,7 @@ class ConnectionManager:
             )
         except (OperationalError, AttributeError):
             await client.send_error_message("Erro ao validar conexão")
-            time.sleep(0.1)
+            await asyncio.sleep(0.1)
             await self.disconnect(client)
 
     async def __process_message(
@@ -305,30 +813,67 @@ class ConnectionManager:
                 await self.__process_edit_event(message, client)
             elif client.token and message.message_type == MessageType.REMOVE_EVENT:
                 await self.__process_remove_event(message, client)
+            elif client.token and message.message_type == MessageType.SUBSCRIBE:
+                await self.__process_subscribe(message, client)
+            elif client.token and message.message_type == MessageType.ADD_RECURRENCE:
+                await self.__process_add_recurrence(message, client)
+            elif client.token and message.message_type == MessageType.REMOVE_RECURRENCE:
+                await self.__process_remove_recurrence(message, client)
+            elif client.token and message.message_type == MessageType.SKIP_OCCURRENCE:
+                await self.__process_skip_occurrence(message, client)
+            elif client.token and message.message_type == MessageType.DETACH_OCCURRENCE:
+                await self.__process_detach_occurrence(message, client)
             elif not client.token:
                 await client.send_error_message("Token inválido")
-                time.sleep(0.1)
+                await asyncio.sleep(0.1)
                 await self.disconnect(client)
             else:
                 await client.send_invalid_message()
         except (AttributeError, OperationalError):
             await client.send_error_message("Erro ao processar a mensagem")
 
+    async def __process_queued_message(
+        self, websocket: ClientWebSocket, message: Message, trace: Optional[Trace]
+    ) -> None:
+        """Process a queued message, tracing it while profiling"""
+        if trace is None:
+            await self.__process_message(message, websocket)
+            return
+        trace.add("queue_wait", time.monotonic() - trace.enqueued_at)
+        token = current_trace.set(trace)
+        try:
+            with trace.span("handle"):
+                await self.__process_message(message, websocket)
+        finally:
+            current_trace.reset(token)
+            tracer.export(trace)
+
     async def __process_queue(self):
         while True:
-            if not self.queue.empty():
-                websocket, message = await self.queue.get()
-                logger.info("Processing message: %s", message.message_type)
-                await self.__process_message(message, websocket)
-            await asyncio.sleep(1)
-
-    def __start_queue_processor(self):
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        loop.run_until_complete(self.__process_queue())
-
-    def start_main_thread(self):
-        """Start the main thread"""
-        thread = Thread(target=self.__start_queue_processor)
-        thread.start()
-        logger.info("Main thread started")
+            websocket, message, trace = await self.queue.get()
+            logger.info("Processing message: %s", message.message_type)
+            try:
+                await self.__process_queued_message(websocket, message, trace)
+            except Exception:  # pylint: disable=broad-except
+                # a failing message must not stop the queue of every clinic
+                logger.exception("Error processing message %s", message.message_type)
+
+    def start(self) -> None:
+        """Start the queue processor on the running loop"""
+        if self.processor is not None:
+            return
+        ConnectionManager.queue = FairQueue(CLINIC_WEIGHTS)
+        ConnectionManager.processor = asyncio.create_task(self.__process_queue())
+        logger.info("Queue processor started")
+
+    async def stop(self) -> None:
+        """Stop the queue processor"""
+        if self.processor is None:
+            return
+        self.processor.cancel()
+        try:
+            await self.processor
+        except asyncio.CancelledError:
+            pass
+        ConnectionManager.processor = None
+        logger.info("Queue processor stopped")
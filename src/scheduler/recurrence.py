@@ -0,0 +1,178 @@
+"""Lazy expansion of recurring scheduler events"""
+
+from datetime import MAXYEAR, date, datetime, timedelta
+from functools import lru_cache
+from typing import Dict, List, Optional, Set, Tuple
+
+from tortoise.backends.base.client import BaseDBAsyncClient
+from tortoise.expressions import Q
+
+from src.enums import RecurrenceFrequency
+from src.models import RecurrenceExceptionModel, RecurrenceModel
+from src.utils import get_day_start
+
+
+class Occurrence:
+    """Single expanded occurrence of a recurrence rule"""
+
+    __slots__ = (
+        "id",
+        "recurrence_id",
+        "date",
+        "status",
+        "description",
+        "is_return",
+        "is_off",
+        "off_reason",
+        "patient",
+        "desk",
+    )
+
+    def __init__(self, rule: RecurrenceModel, occurrence_date: datetime) -> None:
+        self.id = None
+        self.recurrence_id = rule.id
+        self.date = occurrence_date
+        self.status = rule.status
+        self.description = rule.description
+        self.is_return = rule.is_return
+        self.is_off = rule.is_off
+        self.off_reason = rule.off_reason
+        self.patient = rule.patient
+        self.desk = rule.desk
+
+
+def _ceil_div(numerator: int, denominator: int) -> int:
+    """Integer division rounding towards positive infinity"""
+    return -(-numerator // denominator)
+
+
+def _add_months(value: datetime, months: int) -> Optional[datetime]:
+    """Shift a datetime by months, None when the day does not exist"""
+    month_index = value.month - 1 + months
+    try:
+        return value.replace(
+            year=value.year + month_index // 12, month=month_index % 12 + 1
+        )
+    except ValueError:
+        return None
+
+
+@lru_cache(maxsize=4096)
+def _last_monthly_index(start: datetime, step: int, count: int) -> int:
+    """Return the index of the count-th existing monthly occurrence
+
+    As in RFC 5545, months without the start day are neither produced nor
+    counted, so the index can go past count - 1 for starts after the 28th.
+    The walk stops at the last representable year.
+    """
+    if start.day <= 28:
+        return count - 1
+    index = -1
+    while count:
+        index += 1
+        if start.year + (start.month - 1 + index * step) // 12 > MAXYEAR:
+            break
+        if _add_months(start, index * step) is not None:
+            count -= 1
+    return index
+
+
+@lru_cache(maxsize=4096)
+def expand_rule(
+    start: datetime,
+    frequency: RecurrenceFrequency,
+    interval: int,
+    until: Optional[date],
+    count: Optional[int],
+    window_start: date,
+    window_end: date,
+) -> Tuple[datetime, ...]:
+    """Return the occurrences of a rule inside the inclusive window
+
+    The first and last occurrence indexes inside the window are computed
+    directly, so the cost depends only on the occurrences returned and not on
+    how long ago the series started. Monthly occurrences falling on a day the
+    month does not have are skipped and do not count towards count.
+    """
+    interval = max(interval, 1)
+    first_day = start.date()
+    last_day = window_end if until is None else min(window_end, until)
+    if last_day < first_day or last_day < window_start:
+        return ()
+    if frequency == RecurrenceFrequency.MONTHLY:
+        step = interval
+        first = _ceil_div(
+            (window_start.year - first_day.year) * 12
+            + window_start.month
+            - first_day.month,
+            step,
+        )
+        last = (
+            (last_day.year - first_day.year) * 12 + last_day.month - first_day.month
+        ) // step
+    else:
+        step = interval * (7 if frequency == RecurrenceFrequency.WEEKLY else 1)
+        first = _ceil_div((window_start - first_day).days, step)
+        last = (last_day - first_day).days // step
+    first = max(first, 0)
+    if count is not None and frequency == RecurrenceFrequency.MONTHLY:
+        last = min(last, _last_monthly_index(start, step, count))
+    elif count is not None:
+        last = min(last, count - 1)
+
+    occurrences: List[datetime] = []
+    for index in range(first, last + 1):
+        if frequency == RecurrenceFrequency.MONTHLY:
+            occurrence = _add_months(start, index * step)
+        else:
+            occurrence = start + timedelta(days=index * step)
+        if occurrence is not None and window_start <= occurrence.date() <= last_day:
+            occurrences.append(occurrence)
+    return tuple(occurrences)
+
+
+async def get_window_occurrences(
+    clinic_id: int,
+    window_start: date,
+    window_end: date,
+    using_db: Optional[BaseDBAsyncClient] = None,
+) -> List[Occurrence]:
+    """Expand every series of the clinic that overlaps the inclusive window"""
+    rules = (
+        await RecurrenceModel.filter(
+            Q(until__isnull=True) | Q(until__gte=window_start),
+            clinic_id=clinic_id,
+            start__lt=get_day_start(window_end + timedelta(days=1)),
+        )
+        .using_db(using_db)
+        .all()
+    )
+    if not rules:
+        return []
+    skipped: Dict[int, Set[date]] = {}
+    for recurrence_id, skipped_date in (
+        await RecurrenceExceptionModel.filter(
+            recurrence_id__in=[rule.id for rule in rules],
+            date__gte=window_start,
+            date__lte=window_end,
+        )
+        .using_db(using_db)
+        .values_list("recurrence_id", "date")
+    ):
+        skipped.setdefault(recurrence_id, set()).add(skipped_date)
+
+    occurrences: List[Occurrence] = []
+    for rule in rules:
+        rule_skipped = skipped.get(rule.id, ())
+        for occurrence_date in expand_rule(
+            rule.start,
+            rule.frequency,
+            rule.interval,
+            rule.until,
+            rule.count,
+            window_start,
+            window_end,
+        ):
+            if occurrence_date.date() not in rule_skipped:
+                occurrences.append(Occurrence(rule, occurrence_date))
+    return occurrences
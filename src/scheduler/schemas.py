@@ -8,7 +8,7 @@ from plus_db_agent.schemas import BaseSchema
 from pydantic import Field, field_validator, model_validator
 from typing_extensions import Self
 
-from src.enums import MessageType
+from src.enums import MessageType, RecurrenceFrequency
 
 
 class AddEventSchema(BaseSchema):
@@ -32,11 +32,11 @@ class AddEventSchema(BaseSchema):
             raise ValueError("Informe o motivo da ausência.")
         return self
 
-    @field_validator("date", mode="before")
+    @field_validator("date")
     @classmethod
     def check_date(cls, value: datetime) -> datetime:
-        """Check if date is in the future."""
-        if value < datetime.now():
+        """Check if date is in the future, in its own timezone when informed."""
+        if value < datetime.now(value.tzinfo):
             raise ValueError("A data do agendamento deve ser futura.")
         return value
 
@@ -59,20 +59,39 @@ class AddEventSchema(BaseSchema):
     #     return self
 
 
+class EventValuesSchema(BaseSchema):
+    """Values of an event as the client last saw them"""
+
+    status: Optional[SchedulerStatus] = None
+    date: Optional[datetime] = None
+    description: Optional[str] = None
+    is_return: Optional[bool] = Field(alias="isReturn", default=None)
+    is_off: Optional[bool] = Field(alias="isOff", default=None)
+    off_reason: Optional[str] = Field(alias="offReason", default=None)
+    patient: Optional[str] = None
+    desk: Optional[str] = None
+
+
 class EditEventSchema(BaseSchema):
-    """Schema to edit an event"""
+    """Schema to edit an event
 
-    event_id: int = Field(alias="eventId", default=False)
-    status: Optional[SchedulerStatus]
-    date: datetime
+    Only the informed fields are written. The write is applied only while the
+    event still has the informed version or, without it, the previous values.
+    """
+
+    event_id: int = Field(alias="eventId")
+    version: Optional[int] = None
+    previous: Optional[EventValuesSchema] = None
+    status: Optional[SchedulerStatus] = None
+    date: Optional[datetime] = None
     description: Optional[str] = ""
     is_return: Optional[bool] = Field(alias="isReturn", default=False)
     is_off: Optional[bool] = Field(alias="isOff", default=False)
     off_reason: Optional[str] = Field(alias="offReason", default=None)
     patient_id: Optional[int] = Field(alias="patientId", default=False)
-    patient: Optional[str]
+    patient: Optional[str] = None
     desk_id: Optional[int] = Field(alias="deskId", default=False)
-    desk: Optional[str]
+    desk: Optional[str] = None
 
     @model_validator(mode="after")
     def check_off_reason(self) -> Self:
@@ -81,11 +100,18 @@ class EditEventSchema(BaseSchema):
             raise ValueError("Informe o motivo da ausência.")
         return self
 
-    @field_validator("date", mode="before")
+    @model_validator(mode="after")
+    def check_changes(self) -> Self:
+        """Check if at least one field is changed."""
+        if not self.model_fields_set & set(EventValuesSchema.model_fields):
+            raise ValueError("Informe ao menos um campo a alterar.")
+        return self
+
+    @field_validator("date")
     @classmethod
-    def check_date(cls, value: datetime) -> datetime:
-        """Check if date is in the future."""
-        if value < datetime.now():
+    def check_date(cls, value: Optional[datetime]) -> Optional[datetime]:
+        """Check if date is in the future, in its own timezone when informed."""
+        if value is not None and value < datetime.now(value.tzinfo):
             raise ValueError("A data do agendamento deve ser futura.")
         return value
 
@@ -104,7 +130,9 @@ class EditEventSchema(BaseSchema):
 class EventSchema(BaseSchema):
     """Event Schema"""
 
-    id: int
+    id: Optional[int] = None
+    version: Optional[int] = None
+    recurrence_id: Optional[int] = Field(alias="recurrenceId", default=None)
     date: datetime
     description: Optional[str] = ""
     is_return: Optional[bool] = Field(alias="isReturn", default=False)
@@ -145,6 +173,8 @@ class RemoveEventSchema(BaseSchema):
     """Schema to remove an event"""
 
     event_id: int = Field(alias="eventId")
+    version: Optional[int] = None
+    previous: Optional[EventValuesSchema] = None
 
 
 class ConnectionSchema(BaseSchema):
@@ -165,6 +195,94 @@ class ErrorResponseSchema(BaseSchema):
     error: str
 
 
+class RecurrenceRuleSchema(BaseSchema):
+    """Schema of a recurrence rule"""
+
+    frequency: RecurrenceFrequency
+    interval: int = Field(default=1, ge=1, le=99)
+    until: Optional[date] = None
+    count: Optional[int] = Field(default=None, ge=1, le=1000)
+
+
+class AddRecurrenceSchema(BaseSchema):
+    """Schema to add a recurring event"""
+
+    event: AddEventSchema
+    rule: RecurrenceRuleSchema
+
+    @model_validator(mode="after")
+    def check_until(self) -> Self:
+        """Check if until is not before the first occurrence."""
+        if self.rule.until and self.rule.until < self.event.date.date():
+            raise ValueError("A data final deve ser posterior à data inicial.")
+        return self
+
+
+class RecurrenceSchema(BaseSchema):
+    """Recurring event Schema"""
+
+    id: int
+    rule: RecurrenceRuleSchema
+    event: EventSchema
+
+
+class RemoveRecurrenceSchema(BaseSchema):
+    """Schema to remove a recurring event"""
+
+    recurrence_id: int = Field(alias="recurrenceId")
+
+
+class SkipOccurrenceSchema(BaseSchema):
+    """Schema to remove a single occurrence of a recurring event"""
+
+    recurrence_id: int = Field(alias="recurrenceId")
+    occurrence_date: date = Field(alias="occurrenceDate")
+
+
+class DetachedOccurrenceSchema(BaseSchema):
+    """Occurrence of a recurring event turned into a standalone event"""
+
+    recurrence_id: int = Field(alias="recurrenceId")
+    occurrence_date: date = Field(alias="occurrenceDate")
+    event: EventSchema
+
+
+class ViewWindowSchema(BaseSchema):
+    """Calendar window (inclusive date range) a client is viewing"""
+
+    start: date
+    end: date
+    desk: Optional[str] = None
+
+    @model_validator(mode="after")
+    def check_range(self) -> Self:
+        """Check if the window ends after it starts."""
+        if self.end < self.start:
+            raise ValueError("A data final deve ser posterior à data inicial.")
+        return self
+
+
+class SubscribeSchema(BaseSchema):
+    """Schema to register the calendar windows a client is viewing"""
+
+    windows: list[ViewWindowSchema]
+
+
+class CalendarInvalidatedSchema(BaseSchema):
+    """Notice that the calendar of a date range must be reloaded"""
+
+    first_date: date = Field(alias="firstDate")
+    last_date: date = Field(alias="lastDate")
+    imported: int
+
+
+class ConflictSchema(BaseSchema):
+    """Conflict Response Schema, carries the current event when it exists"""
+
+    error: str
+    event: Optional[EventSchema] = None
+
+
 class Message(BaseSchema):
     """Message Schema"""
 
@@ -172,6 +290,10 @@ class Message(BaseSchema):
     clinic_id: int = Field(alias="clinicId")
     data: Optional[
         Union[
+            AddRecurrenceSchema,
+            DetachedOccurrenceSchema,
+            SkipOccurrenceSchema,
+            RemoveRecurrenceSchema,
             AddEventSchema,
             EditEventSchema,
             GetFullMonthCalendarSchema,
@@ -182,5 +304,10 @@ class Message(BaseSchema):
             CreateUUIDSchema,
             ErrorResponseSchema,
             ReponseEventsCalendarSchema,
+            SubscribeSchema,
+            RecurrenceSchema,
+            CalendarInvalidatedSchema,
+            ConflictSchema,
+            EventSchema,
         ]
     ] = None
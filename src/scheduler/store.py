@@ -0,0 +1,163 @@
+"""Compact in-memory store of the events of active clinics"""
+
+import sys
+import time
+from bisect import bisect_left, bisect_right
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from src.backends import EVENT_COLUMNS
+from src.utils import get_month_windows
+
+Month = Tuple[int, int]
+
+
+def _sort_key(value: datetime) -> datetime:
+    """Return a naive UTC datetime so aware and naive dates compare"""
+    if value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def _day_key(day: date) -> datetime:
+    """Return the sort key of the first instant of the day"""
+    return datetime(day.year, day.month, day.day)
+
+
+def _intern(value: Optional[str]) -> Optional[str]:
+    """Intern repeated strings so equal values share one object"""
+    return sys.intern(value) if value else value
+
+
+class StoredEvent:
+    """Projected scheduler event, with only the columns sent to clients"""
+
+    __slots__ = EVENT_COLUMNS
+
+    # stored events are never recurring occurrences
+    recurrence_id = None
+
+    def __init__(self, values: Iterable) -> None:
+        for column, value in zip(EVENT_COLUMNS, values):
+            setattr(self, column, value)
+        self.patient = _intern(self.patient)
+        self.desk = _intern(self.desk)
+
+    @classmethod
+    def from_row(cls, row: dict) -> "StoredEvent":
+        """Build the event from a row keyed by column"""
+        return cls(row[column] for column in EVENT_COLUMNS)
+
+
+class ClinicEvents:
+    """Events of a clinic kept sorted by date in parallel lists
+
+    Dates are kept as naive UTC sort keys. Only whole months are loaded, a
+    month is served from memory until its ttl expires and writes to loaded
+    months are applied in place. Expired months are reloaded, so writes made
+    by other instances are picked up.
+    """
+
+    def __init__(self, ttl: float) -> None:
+        self.ttl = ttl
+        self.dates: List[datetime] = []
+        self.events: List[StoredEvent] = []
+        self.months: Dict[Month, float] = {}
+        self.written_at: Optional[float] = None
+
+    def __len__(self) -> int:
+        return len(self.events)
+
+    def missing_months(self, start: date, end: date) -> List[Tuple[date, date]]:
+        """Return the whole month windows of the range not loaded yet"""
+        missing = []
+        now = time.monotonic()
+        for window_start, _ in get_month_windows(start.replace(day=1), end):
+            loaded_at = self.months.get((window_start.year, window_start.month))
+            if loaded_at is None or now - loaded_at > self.ttl:
+                next_month = (window_start + timedelta(days=32)).replace(day=1)
+                missing.append((window_start, next_month - timedelta(days=1)))
+        return missing
+
+    def load(self, month_start: date, rows: Iterable[tuple]) -> None:
+        """Replace the events of a month by its projected rows"""
+        month_start = month_start.replace(day=1)
+        next_month = (month_start + timedelta(days=32)).replace(day=1)
+        first = bisect_left(self.dates, _day_key(month_start))
+        last = bisect_left(self.dates, _day_key(next_month))
+        del self.dates[first:last]
+        del self.events[first:last]
+        self.months[(month_start.year, month_start.month)] = time.monotonic()
+        for row in rows:
+            self.__insert(StoredEvent(row))
+
+    def window(self, start: date, end: date) -> List[StoredEvent]:
+        """Return the events inside the inclusive window"""
+        first = bisect_left(self.dates, _day_key(start))
+        last = bisect_left(self.dates, _day_key(end + timedelta(days=1)))
+        return self.events[first:last]
+
+    def __insert(self, event: StoredEvent) -> None:
+        """Insert the event keeping the lists sorted"""
+        key = _sort_key(event.date)
+        index = bisect_right(self.dates, key)
+        self.dates.insert(index, key)
+        self.events.insert(index, event)
+
+    def __is_loaded(self, value: datetime) -> bool:
+        """Check if the month of the date is loaded"""
+        key = _sort_key(value)
+        return (key.year, key.month) in self.months
+
+    def add(self, row: dict) -> None:
+        """Apply a created event"""
+        if self.__is_loaded(row["date"]):
+            self.__insert(StoredEvent.from_row(row))
+
+    def remove(self, event_id: int, event_date: datetime) -> None:
+        """Apply a removed event"""
+        if not self.__is_loaded(event_date):
+            return
+        key = _sort_key(event_date)
+        first = bisect_left(self.dates, key)
+        last = bisect_right(self.dates, key)
+        for index in range(first, last):
+            if self.events[index].id == event_id:
+                del self.dates[index]
+                del self.events[index]
+                return
+
+    def update(self, row: dict) -> None:
+        """Apply an edited event, which may have moved to another date"""
+        self.remove(row["id"], row["previous_date"])
+        self.add(row)
+
+
+class EventStore:
+    """Clinic event stores, kept while the clinic has open connections"""
+
+    def __init__(self, enabled: bool, ttl: float) -> None:
+        self.enabled = enabled
+        self.ttl = ttl
+        self._clinics: Dict[int, ClinicEvents] = {}
+
+    def get(self, clinic_id: int) -> ClinicEvents:
+        """Return the store of the clinic, creating it when missing"""
+        clinic_events = self._clinics.get(clinic_id)
+        if clinic_events is None:
+            clinic_events = self._clinics[clinic_id] = ClinicEvents(self.ttl)
+        return clinic_events
+
+    def get_loaded(self, clinic_id: int) -> Optional[ClinicEvents]:
+        """Return the store of the clinic, None when not loaded"""
+        return self._clinics.get(clinic_id)
+
+    def mark_write(self, clinic_id: int) -> None:
+        """Record a write so the next loads of the clinic read the primary"""
+        clinic_events = self._clinics.get(clinic_id)
+        if clinic_events is not None:
+            clinic_events.written_at = time.monotonic()
+
+    def drop(self, clinic_id: int) -> None:
+        """Drop the store of the clinic"""
+        self._clinics.pop(clinic_id, None)
@@ -0,0 +1,101 @@
+"""Interval-indexed table of the calendar windows each client is viewing"""
+
+from bisect import bisect_right
+from datetime import date, datetime
+from typing import Dict, Iterable, List, Optional, Set, Tuple, Union
+
+from src.scheduler.client import ClientWebSocket
+from src.scheduler.schemas import ViewWindowSchema
+
+# (start ordinal, end ordinal, desk, client) sorted by start ordinal
+Entry = Tuple[int, int, Optional[str], ClientWebSocket]
+
+
+class _ClinicIndex:
+    """Subscriptions of a single clinic sorted by window start"""
+
+    __slots__ = ("entries", "starts", "max_span")
+
+    def __init__(self) -> None:
+        self.entries: List[Entry] = []
+        self.starts: List[int] = []
+        self.max_span = 0
+
+    def add(self, entry: Entry) -> None:
+        """Insert an entry keeping the start order"""
+        position = bisect_right(self.starts, entry[0])
+        self.starts.insert(position, entry[0])
+        self.entries.insert(position, entry)
+        self.max_span = max(self.max_span, entry[1] - entry[0])
+
+    def remove_client(self, client: ClientWebSocket) -> None:
+        """Drop every entry that belongs to the client"""
+        self.entries = [entry for entry in self.entries if entry[3] is not client]
+        self.starts = [entry[0] for entry in self.entries]
+        self.max_span = max((entry[1] - entry[0] for entry in self.entries), default=0)
+
+    def stab(self, day: int, desk: Optional[str], found: Set[ClientWebSocket]) -> None:
+        """Collect the clients whose windows contain the given day"""
+        position = bisect_right(self.starts, day)
+        lowest_start = day - self.max_span
+        while position > 0:
+            position -= 1
+            start, end, window_desk, client = self.entries[position]
+            if start < lowest_start:
+                break
+            if end >= day and (
+                window_desk is None or desk is None or window_desk == desk
+            ):
+                found.add(client)
+
+
+class SubscriptionTable:
+    """Index of the calendar windows registered by each client, per clinic"""
+
+    def __init__(self) -> None:
+        self._clinics: Dict[int, _ClinicIndex] = {}
+
+    def subscribe(
+        self, client: ClientWebSocket, windows: List[ViewWindowSchema]
+    ) -> None:
+        """Replace the windows the client is viewing"""
+        self.unsubscribe(client)
+        client.windows = list(windows)
+        if not windows:
+            return
+        index = self._clinics.setdefault(client.clinic_id, _ClinicIndex())
+        for window in windows:
+            index.add(
+                (window.start.toordinal(), window.end.toordinal(), window.desk, client)
+            )
+
+    def unsubscribe(self, client: ClientWebSocket) -> None:
+        """Remove every window registered by the client"""
+        if not client.windows:
+            return
+        client.windows = []
+        index = self._clinics.get(client.clinic_id)
+        if index is None:
+            return
+        index.remove_client(client)
+        if not index.entries:
+            del self._clinics[client.clinic_id]
+
+    def match(
+        self,
+        clinic_id: int,
+        dates: Iterable[Union[date, datetime]],
+        desk: Optional[str] = None,
+    ) -> Set[ClientWebSocket]:
+        """Return the subscribed clients whose windows intersect any of the dates"""
+        found: Set[ClientWebSocket] = set()
+        index = self._clinics.get(clinic_id)
+        if index is None:
+            return found
+        for day in dates:
+            if day is None:
+                continue
+            if isinstance(day, datetime):
+                day = day.date()
+            index.stab(day.toordinal(), desk, found)
+        return found
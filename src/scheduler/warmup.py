@@ -0,0 +1,70 @@
+"""Warmup of the service caches"""
+
+import asyncio
+import logging
+from datetime import date, timedelta
+
+from plus_db_agent.models import HolidayModel, SchedulerModel
+
+from src.backends import clinic_ids
+from src.config import WARMUP_CLINICS
+from src.database import get_read_connection
+from src.scheduler.api_client import get_api_client
+from src.scheduler.manager import ConnectionManager
+from src.utils import get_day_start, get_week
+
+logger = logging.getLogger(__name__)
+
+
+async def preload_holidays() -> None:
+    """Fetch the current year holidays when they are not in the database"""
+    current_year = date.today().year
+    if await HolidayModel.exists(date__year=current_year):
+        return
+    api_client = get_api_client()
+    holidays = await asyncio.to_thread(api_client.get_current_year_holidays)
+    await api_client.save_holidays(holidays)
+    logger.info("Preloaded %s holidays of %s", len(holidays), current_year)
+
+
+async def preload_calendars() -> None:
+    """Load the current and next week of the recently active clinics
+
+    Nothing is kept when neither the window cache nor the event store is on.
+    """
+    manager = ConnectionManager()
+    if manager.calendar_cache.ttl <= 0 and not manager.event_store.enabled:
+        logger.info("Calendar caches are disabled, skipping the preload")
+        return
+    week = list(get_week(date.today()))
+    next_week = [day + timedelta(days=7) for day in week]
+    clinic_ids = (
+        await SchedulerModel.filter(
+            date__gte=get_day_start(week[0]),
+            date__lt=get_day_start(next_week[-1] + timedelta(days=1)),
+        )
+        .distinct()
+        .limit(WARMUP_CLINICS)
+        .using_db(get_read_connection())
+        .values_list("clinic_id", flat=True)
+    )
+    for clinic_id in clinic_ids:
+        await manager.preload_window(clinic_id, week[0], week[-1])
+        await manager.preload_window(clinic_id, next_week[0], next_week[-1])
+    logger.info("Preloaded calendars of %s clinics", len(clinic_ids))
+
+
+async def warmup() -> None:
+    """Warm the caches up, failures are logged and do not stop the service"""
+    try:
+        await clinic_ids.refresh()
+    except Exception:  # pylint: disable=broad-except
+        logger.exception("Clinic ids warmup failed")
+    try:
+        await preload_holidays()
+    except Exception:  # pylint: disable=broad-except
+        logger.exception("Holidays warmup failed")
+    try:
+        await preload_calendars()
+    except Exception:  # pylint: disable=broad-except
+        logger.exception("Calendars warmup failed")
@@ -0,0 +1,72 @@
+"""Tests of the desk utilization analytics"""
+
+from datetime import date
+
+import numpy as np
+
+from src.scheduler.analytics import compute_analytics
+
+# 2027-03-01 is a monday, the second row of a sunday first week
+MONDAY = 1
+
+
+def _analytics(dates, desks, statuses, offs, start=date(2027, 3, 1), end=None):
+    """Compute the analytics of plain lists"""
+    return compute_analytics(
+        np.array(dates, dtype="datetime64[m]"),
+        np.array(desks, dtype=object),
+        np.array(statuses, dtype=object),
+        np.array(offs, dtype=bool),
+        start,
+        end or start,
+    )
+
+
+def test_empty_range():
+    """A range without events has no desks"""
+    result = _analytics([], [], [], [])
+    assert result["total"] == 0
+    assert result["desks"] == {}
+
+
+def test_same_desk_hour_counts_once():
+    """Two appointments in the same desk hour occupy it once"""
+    result = _analytics(
+        ["2027-03-01T09:00", "2027-03-01T09:30", "2027-03-01T10:00"],
+        ["A", "A", "B"],
+        ["WAITING_CONFIRMATION"] * 3,
+        [False] * 3,
+    )
+    utilization = result["desks"]["A"]["utilization"]
+    assert utilization[MONDAY][9] == 1.0
+    assert utilization[MONDAY][10] == 0.0
+    assert result["desks"]["B"]["utilization"][MONDAY][10] == 1.0
+    assert result["desks"]["A"]["total"] == 2
+
+
+def test_utilization_is_a_share_of_the_range():
+    """An hour occupied in one of two mondays is half used"""
+    result = _analytics(
+        ["2027-03-01T09:00"],
+        ["A"],
+        ["WAITING_CONFIRMATION"],
+        [False],
+        end=date(2027, 3, 8),
+    )
+    assert result["desks"]["A"]["utilization"][MONDAY][9] == 0.5
+
+
+def test_off_blocks_and_rates():
+    """Off blocks have their own heatmap and rates"""
+    result = _analytics(
+        ["2027-03-01T09:00", "2027-03-01T11:00"],
+        ["A", "A"],
+        ["WAITING_CONFIRMATION", "CONFIRMED"],
+        [False, True],
+    )
+    desk = result["desks"]["A"]
+    assert desk["offUtilization"][MONDAY][11] == 1.0
+    assert desk["utilization"][MONDAY][11] == 0.0
+    assert desk["offRate"] == 0.5
+    assert result["offRate"] == 0.5
+    assert result["statusRates"] == {"CONFIRMED": 0.5, "WAITING_CONFIRMATION": 0.5}
@@ -0,0 +1,64 @@
+"""Tests of the fair message queue"""
+
+import asyncio
+from typing import List
+
+from src.enums import MessageType
+from src.scheduler.fair_queue import FairQueue
+
+
+def _drain(queue: FairQueue) -> List:
+    """Return every queued item in the order the queue serves them"""
+
+    async def drain() -> List:
+        return [await queue.get() for _ in range(queue.qsize())]
+
+    return asyncio.run(drain())
+
+
+def test_priority_classes_are_served_in_order():
+    """Handshakes go before writes, and writes before reads"""
+    queue = FairQueue()
+    queue.put_nowait(1, MessageType.GET_DAY_CALENDAR, "read")
+    queue.put_nowait(1, MessageType.ADD_EVENT, "write")
+    queue.put_nowait(1, MessageType.CONNECTION, "handshake")
+    assert _drain(queue) == ["handshake", "write", "read"]
+
+
+def test_flooding_clinic_does_not_delay_others():
+    """Clinics of the same class are interleaved"""
+    queue = FairQueue()
+    for index in range(3):
+        queue.put_nowait(1, MessageType.GET_DAY_CALENDAR, f"a{index}")
+    queue.put_nowait(2, MessageType.GET_DAY_CALENDAR, "b0")
+    assert _drain(queue) == ["a0", "b0", "a1", "a2"]
+
+
+def test_weights_share_the_queue():
+    """A clinic with weight 2 is served twice as often"""
+    queue = FairQueue({1: 2.0})
+    for index in range(4):
+        queue.put_nowait(1, MessageType.GET_DAY_CALENDAR, f"a{index}")
+        queue.put_nowait(2, MessageType.GET_DAY_CALENDAR, f"b{index}")
+    assert _drain(queue) == ["a0", "b0", "a1", "b1", "a2", "a3", "b2", "b3"]
+
+
+def test_costlier_messages_take_a_larger_share():
+    """A month calendar costs as much as four day calendars"""
+    queue = FairQueue()
+    queue.put_nowait(1, MessageType.GET_FULL_MONTH_CALENDAR, "month0")
+    queue.put_nowait(1, MessageType.GET_FULL_MONTH_CALENDAR, "month1")
+    for index in range(4):
+        queue.put_nowait(2, MessageType.GET_DAY_CALENDAR, f"day{index}")
+    served = _drain(queue)
+    assert served.index("month1") > served.index("day3")
+
+
+def test_stats_count_served_messages():
+    """Served messages are counted per priority class"""
+    queue = FairQueue()
+    queue.put_nowait(1, MessageType.ADD_EVENT, "write")
+    _drain(queue)
+    stats = queue.get_stats()
+    assert stats["write"]["count"] == 1
+    assert stats["write"]["queued"] == 0
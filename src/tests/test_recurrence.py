@@ -0,0 +1,137 @@
+"""Tests of the recurrence expansion"""
+
+import time
+from datetime import date, datetime
+
+from src.enums import RecurrenceFrequency
+from src.scheduler.recurrence import expand_rule
+
+MONTHLY = RecurrenceFrequency.MONTHLY
+WEEKLY = RecurrenceFrequency.WEEKLY
+DAILY = RecurrenceFrequency.DAILY
+
+
+def test_monthly_skips_months_without_the_day():
+    """A series on the 31st only happens in months with 31 days"""
+    occurrences = expand_rule(
+        datetime(2027, 1, 31, 9),
+        MONTHLY,
+        1,
+        None,
+        None,
+        date(2027, 1, 1),
+        date(2027, 6, 30),
+    )
+    assert [occurrence.month for occurrence in occurrences] == [1, 3, 5]
+
+
+def test_monthly_29th_in_leap_year():
+    """February 29th only exists in leap years"""
+    occurrences = expand_rule(
+        datetime(2027, 1, 29, 9),
+        MONTHLY,
+        1,
+        None,
+        None,
+        date(2027, 2, 1),
+        date(2028, 2, 29),
+    )
+    assert all(
+        occurrence.month != 2 or occurrence.year == 2028 for occurrence in occurrences
+    )
+    assert occurrences[0] == datetime(2027, 3, 29, 9)
+    assert occurrences[-1] == datetime(2028, 2, 29, 9)
+
+
+def test_monthly_count_does_not_count_skipped_months():
+    """COUNT counts only the occurrences that exist"""
+    occurrences = expand_rule(
+        datetime(2027, 1, 31, 9),
+        MONTHLY,
+        1,
+        None,
+        4,
+        date(2027, 1, 1),
+        date(2028, 12, 31),
+    )
+    assert [(occurrence.year, occurrence.month) for occurrence in occurrences] == [
+        (2027, 1),
+        (2027, 3),
+        (2027, 5),
+        (2027, 7),
+    ]
+
+
+def test_monthly_large_count_returns():
+    """A count going past the last representable year does not hang"""
+    started_at = time.monotonic()
+    occurrences = expand_rule(
+        datetime(2027, 1, 31, 9),
+        MONTHLY,
+        1,
+        None,
+        100_000,
+        date(2027, 1, 1),
+        date(2027, 12, 31),
+    )
+    assert len(occurrences) == 7
+    assert time.monotonic() - started_at < 5
+
+
+def test_monthly_crosses_year_end():
+    """Monthly occurrences roll over into the next year"""
+    occurrences = expand_rule(
+        datetime(2027, 11, 15, 9),
+        MONTHLY,
+        1,
+        None,
+        None,
+        date(2027, 12, 1),
+        date(2028, 1, 31),
+    )
+    assert occurrences == (datetime(2027, 12, 15, 9), datetime(2028, 1, 15, 9))
+
+
+def test_weekly_crosses_year_end_with_count():
+    """Weekly occurrences keep their step across the year end and stop at count"""
+    occurrences = expand_rule(
+        datetime(2027, 12, 20, 9),
+        WEEKLY,
+        1,
+        None,
+        3,
+        date(2027, 12, 1),
+        date(2028, 1, 31),
+    )
+    assert occurrences == (
+        datetime(2027, 12, 20, 9),
+        datetime(2027, 12, 27, 9),
+        datetime(2028, 1, 3, 9),
+    )
+
+
+def test_window_after_start_and_until():
+    """Only the occurrences inside the window and until are returned"""
+    occurrences = expand_rule(
+        datetime(2027, 1, 1, 9),
+        DAILY,
+        2,
+        date(2027, 1, 9),
+        None,
+        date(2027, 1, 4),
+        date(2027, 1, 31),
+    )
+    assert [occurrence.day for occurrence in occurrences] == [5, 7, 9]
+
+
+def test_window_before_start():
+    """A window before the series start has no occurrences"""
+    assert not expand_rule(
+        datetime(2027, 3, 1, 9),
+        DAILY,
+        1,
+        None,
+        None,
+        date(2027, 1, 1),
+        date(2027, 2, 28),
+    )
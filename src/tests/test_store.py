@@ -0,0 +1,103 @@
+"""Tests of the in-memory event store"""
+
+from datetime import date, datetime, timezone
+
+from src.backends import EVENT_COLUMNS
+from src.scheduler.store import ClinicEvents
+
+
+def _row(event_id: int, event_date: datetime, desk: str = "A") -> dict:
+    """Return a projected event row keyed by column"""
+    return {
+        "id": event_id,
+        "version": 1,
+        "date": event_date,
+        "description": "",
+        "is_return": False,
+        "is_off": False,
+        "off_reason": None,
+        "patient": "Paciente",
+        "desk": desk,
+    }
+
+
+def _values(row: dict) -> tuple:
+    """Return the row as the tuple the database projection returns"""
+    return tuple(row[column] for column in EVENT_COLUMNS)
+
+
+def _ids(events) -> list:
+    """Return the ids of the events"""
+    return [event.id for event in events]
+
+
+def test_load_and_window():
+    """Loaded events are served sorted by date inside the window"""
+    clinic_events = ClinicEvents(ttl=60)
+    clinic_events.load(
+        date(2027, 3, 1),
+        [
+            _values(_row(2, datetime(2027, 3, 10, 9))),
+            _values(_row(1, datetime(2027, 3, 2, 9))),
+            _values(_row(3, datetime(2027, 3, 31, 23))),
+        ],
+    )
+    assert _ids(clinic_events.window(date(2027, 3, 1), date(2027, 3, 31))) == [1, 2, 3]
+    assert _ids(clinic_events.window(date(2027, 3, 2), date(2027, 3, 9))) == [1]
+
+
+def test_missing_months():
+    """Only months not loaded, or expired, are missing"""
+    clinic_events = ClinicEvents(ttl=60)
+    clinic_events.load(date(2027, 3, 1), [])
+    assert clinic_events.missing_months(date(2027, 3, 5), date(2027, 4, 2)) == [
+        (date(2027, 4, 1), date(2027, 4, 30))
+    ]
+    expired = ClinicEvents(ttl=-1)
+    expired.load(date(2027, 3, 1), [])
+    assert expired.missing_months(date(2027, 3, 5), date(2027, 3, 6)) == [
+        (date(2027, 3, 1), date(2027, 3, 31))
+    ]
+
+
+def test_reload_replaces_the_month():
+    """Reloading a month replaces its events without duplicates"""
+    clinic_events = ClinicEvents(ttl=60)
+    clinic_events.load(date(2027, 3, 1), [_values(_row(1, datetime(2027, 3, 2, 9)))])
+    clinic_events.load(date(2027, 4, 1), [_values(_row(5, datetime(2027, 4, 2, 9)))])
+    clinic_events.load(
+        date(2027, 3, 1),
+        [
+            _values(_row(1, datetime(2027, 3, 2, 9))),
+            _values(_row(2, datetime(2027, 3, 3, 9))),
+        ],
+    )
+    assert _ids(clinic_events.window(date(2027, 3, 1), date(2027, 4, 30))) == [1, 2, 5]
+
+
+def test_writes_apply_only_to_loaded_months():
+    """Adds, moves and removals update the loaded months in place"""
+    clinic_events = ClinicEvents(ttl=60)
+    clinic_events.load(date(2027, 3, 1), [_values(_row(1, datetime(2027, 3, 2, 9)))])
+    clinic_events.add(_row(2, datetime(2027, 3, 5, 9)))
+    clinic_events.add(_row(3, datetime(2027, 5, 5, 9)))
+    assert _ids(clinic_events.window(date(2027, 1, 1), date(2027, 12, 31))) == [1, 2]
+
+    moved = _row(2, datetime(2027, 3, 1, 8))
+    moved["previous_date"] = datetime(2027, 3, 5, 9)
+    clinic_events.update(moved)
+    assert _ids(clinic_events.window(date(2027, 3, 1), date(2027, 3, 31))) == [2, 1]
+
+    clinic_events.remove(1, datetime(2027, 3, 2, 9))
+    assert _ids(clinic_events.window(date(2027, 3, 1), date(2027, 3, 31))) == [2]
+
+
+def test_aware_dates_are_sorted_in_utc():
+    """Aware dates are kept by their UTC instant"""
+    clinic_events = ClinicEvents(ttl=60)
+    clinic_events.load(
+        date(2027, 3, 1),
+        [_values(_row(1, datetime(2027, 3, 2, 9, tzinfo=timezone.utc)))],
+    )
+    clinic_events.add(_row(2, datetime(2027, 3, 2, 8)))
+    assert _ids(clinic_events.window(date(2027, 3, 2), date(2027, 3, 2))) == [2, 1]
@@ -0,0 +1,71 @@
+"""Tests of the calendar window subscriptions"""
+
+from datetime import date, datetime
+from typing import Optional
+
+from src.scheduler.client import ClientWebSocket
+from src.scheduler.schemas import ViewWindowSchema
+from src.scheduler.subscriptions import SubscriptionTable
+
+
+def _client(clinic_id: int = 1) -> ClientWebSocket:
+    """Return a client of the clinic without a websocket"""
+    client = ClientWebSocket(wb=None)
+    client.clinic_id = clinic_id
+    return client
+
+
+def _window(start: date, end: date, desk: Optional[str] = None) -> ViewWindowSchema:
+    """Return a view window"""
+    return ViewWindowSchema(start=start, end=end, desk=desk)
+
+
+def test_match_returns_clients_viewing_the_dates():
+    """Only windows containing one of the dates match"""
+    table = SubscriptionTable()
+    week, month = _client(), _client()
+    table.subscribe(week, [_window(date(2027, 3, 1), date(2027, 3, 7))])
+    table.subscribe(month, [_window(date(2027, 3, 1), date(2027, 3, 31))])
+    assert table.match(1, [datetime(2027, 3, 20, 9)]) == {month}
+    assert table.match(1, [date(2027, 3, 7)]) == {week, month}
+    assert not table.match(1, [date(2027, 4, 1)])
+
+
+def test_match_is_scoped_by_clinic():
+    """Windows of other clinics never match"""
+    table = SubscriptionTable()
+    table.subscribe(_client(2), [_window(date(2027, 3, 1), date(2027, 3, 7))])
+    assert not table.match(1, [date(2027, 3, 3)])
+
+
+def test_match_filters_by_desk():
+    """Desk windows match their desk, or any desk when the event has none"""
+    table = SubscriptionTable()
+    desk_a, any_desk = _client(), _client()
+    table.subscribe(desk_a, [_window(date(2027, 3, 1), date(2027, 3, 7), "A")])
+    table.subscribe(any_desk, [_window(date(2027, 3, 1), date(2027, 3, 7))])
+    assert table.match(1, [date(2027, 3, 3)], "A") == {desk_a, any_desk}
+    assert table.match(1, [date(2027, 3, 3)], "B") == {any_desk}
+    assert table.match(1, [date(2027, 3, 3)]) == {desk_a, any_desk}
+
+
+def test_long_window_before_short_ones_still_matches():
+    """A long window starting earlier is found past later short windows"""
+    table = SubscriptionTable()
+    long, short = _client(), _client()
+    table.subscribe(long, [_window(date(2027, 1, 1), date(2027, 12, 31))])
+    table.subscribe(short, [_window(date(2027, 6, 1), date(2027, 6, 2))])
+    assert table.match(1, [date(2027, 9, 1)]) == {long}
+
+
+def test_subscribe_replaces_and_unsubscribe_removes():
+    """Windows are replaced on subscribe and dropped on unsubscribe"""
+    table = SubscriptionTable()
+    client = _client()
+    table.subscribe(client, [_window(date(2027, 3, 1), date(2027, 3, 7))])
+    table.subscribe(client, [_window(date(2027, 4, 1), date(2027, 4, 7))])
+    assert not table.match(1, [date(2027, 3, 3)])
+    assert table.match(1, [date(2027, 4, 3)]) == {client}
+    table.unsubscribe(client)
+    assert not client.windows
+    assert not table.match(1, [date(2027, 4, 3)])
@@ -1,6 +1,9 @@
 """Utility functions for the project."""
-from datetime import datetime, timedelta
-from typing import Generator, List
+from calendar import monthrange
+from datetime import date, datetime, time, timedelta, timezone
+from typing import Generator, List, Tuple
+
+from tortoise.timezone import get_timezone, get_use_tz, is_naive, make_aware
 
 one_day = timedelta(days=1)
 
@@ -13,3 +16,27 @@ def get_week(date: datetime) -> Generator[List[datetime], None, None]:
     for _ in range(7):
         yield date
         date += one_day
+
+
+def get_month_windows(
+    start: date, end: date
+) -> Generator[Tuple[date, date], None, None]:
+    """Split the inclusive range into inclusive month windows."""
+    window_start = start
+    while window_start <= end:
+        _, last_day = monthrange(window_start.year, window_start.month)
+        window_end = min(window_start.replace(day=last_day), end)
+        yield window_start, window_end
+        window_start = window_end + one_day
+
+
+def get_day_start(day: date) -> datetime:
+    """Return the first instant of the day, the bound datetime fields expect."""
+    return datetime.combine(day, time.min)
+
+
+def to_utc(value: datetime) -> datetime:
+    """Return the datetime as aware UTC, reading naive values as Tortoise stores them."""
+    if is_naive(value):
+        value = make_aware(value, "UTC" if get_use_tz() else get_timezone())
+    return value.astimezone(timezone.utc)